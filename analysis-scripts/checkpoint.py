@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+import numpy as np
+
+def make_temp_file(file_path):
+    """
+    Creates an empty file with a unique name in the directory of file_path, to be written
+    and then moved into place with os.replace, so concurrent runs never share it.
+
+    Returns:
+    - tmp_file_path (str): Path of the temporary file.
+    """
+    fd, tmp_file_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + '.', suffix='.tmp',
+                                         dir=os.path.dirname(file_path) or '.')
+    os.close(fd)
+    return tmp_file_path
+
+def save_checkpoint(checkpoint_file_path, **arrays):
+    """
+    Saves named arrays to a checkpoint file atomically.
+
+    The arrays are written to a temporary file of a unique name, flushed to disk and then
+    renamed over the previous checkpoint, so an interrupted run always leaves either the
+    old or the new checkpoint behind, never a partial one, and leaves no temporary file.
+
+    Parameters:
+    - checkpoint_file_path (str): Path of the checkpoint file (NumPy .npz format).
+    - arrays (np.ndarray): Arrays to store, by name.
+    """
+    tmp_file_path = make_temp_file(checkpoint_file_path)
+    try:
+        with open(tmp_file_path, 'wb') as checkpoint_file:
+            np.savez(checkpoint_file, **arrays)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp_file_path, checkpoint_file_path)
+    except BaseException:
+        os.remove(tmp_file_path)
+        raise
+
+def load_checkpoint(checkpoint_file_path):
+    """
+    Loads the arrays of a checkpoint file written by save_checkpoint.
+
+    Parameters:
+    - checkpoint_file_path (str): Path of the checkpoint file.
+
+    Returns:
+    - arrays (dict): Stored arrays, by name.
+    """
+    with np.load(checkpoint_file_path) as checkpoint:
+        return {name: checkpoint[name] for name in checkpoint.files}
+
+def trajectory_identity(file_path):
+    """
+    Identifies a trajectory file by its absolute path, size and modification time, so that
+    a checkpoint is only resumed on the trajectory it was written for.
+
+    Parameters:
+    - file_path (str): Path of the trajectory file.
+
+    Returns:
+    - identity (np.ndarray): Path, size in bytes and modification time in nanoseconds, as
+      strings.
+    """
+    file_stat = os.stat(file_path)
+    return np.array([os.path.abspath(file_path), str(file_stat.st_size), str(file_stat.st_mtime_ns)])
+
+def check_trajectory_identity(checkpoint_file_path, state, file_path):
+    """
+    Raises a ValueError unless a loaded checkpoint was written for the current version of
+    the trajectory file.
+    """
+    if 'trajectory' not in state or not np.array_equal(state['trajectory'], trajectory_identity(file_path)):
+        raise ValueError(f"{checkpoint_file_path} was written for a different trajectory, or before "
+                         f"{file_path} was modified; remove it to start over")
@@ -0,0 +1,64 @@
+import numpy as np
+
+def label_clusters(protein_pairs, num_proteins):
+    """
+    Labels the connected components of the protein contact graph (aggregates).
+
+    Union-find over all contacts at once: every protein starts as its own label, each
+    contact pulls both of its proteins down to the smaller of their labels, and pointer
+    jumping (label = label[label]) then flattens the label chains. The passes repeat
+    until no label changes, which takes a number of passes that grows only slowly with
+    the size of the clusters.
+
+    Parameters:
+    - protein_pairs (np.ndarray): Indices (p, q) of the proteins in contact (n_pairs x 2).
+    - num_proteins (int): Number of proteins.
+
+    Returns:
+    - labels (np.ndarray): Cluster label of every protein, the smallest protein index of
+      its cluster (num_proteins).
+    """
+    labels = np.arange(num_proteins)
+    protein_pairs = np.asarray(protein_pairs, dtype=np.int64).reshape(-1, 2)
+    first, second = protein_pairs[:, 0], protein_pairs[:, 1]
+    while True:
+        previous_labels = labels.copy()
+        np.minimum.at(labels, labels[first], labels[second])
+        np.minimum.at(labels, labels[second], labels[first])
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous_labels):
+            return labels
+
+def cluster_size_histogram(labels):
+    """
+    Counts the clusters of every size.
+
+    Parameters:
+    - labels (np.ndarray): Cluster label of every protein, as returned by label_clusters.
+
+    Returns:
+    - histogram (np.ndarray): Number of clusters with 1, 2, ..., num_proteins proteins
+      (num_proteins), i.e. monomers, dimers and larger oligomers.
+    """
+    sizes = np.bincount(labels, minlength=len(labels))
+    return np.bincount(sizes[sizes > 0], minlength=len(labels) + 1)[1:]
+
+def write_cluster_histogram_header(output_file, num_proteins):
+    """
+    Writes the header of a time x cluster-size histogram file: the frame, the size of the
+    largest cluster and the number of clusters of each size from 1 to num_proteins.
+    """
+    sizes = "\t".join(str(size) for size in range(1, num_proteins + 1))
+    output_file.write(f"Frame\tLargest\t{sizes}\n")
+
+def write_cluster_histogram_row(output_file, frame_number, histogram):
+    """
+    Appends the cluster-size histogram of one frame to a time x cluster-size histogram file.
+    """
+    largest = np.flatnonzero(histogram)[-1] + 1 if np.any(histogram) else 0
+    counts = "\t".join(str(count) for count in histogram)
+    output_file.write(f"{frame_number}\t{largest}\t{counts}\n")
@@ -0,0 +1,218 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+from checkpoint import save_checkpoint
+from neighbors import VerletContactTracker
+from trajectory import load_trajectory
+
+FFT_CHUNK_SIZE = 2 ** 23  # Values transformed at once: pairs per chunk x padded number of frames
+
+def protein_pair_indices(protein_pairs, num_proteins):
+    """
+    Returns the index of every protein pair (p, q), p < q, in the upper triangle of the
+    num_proteins x num_proteins matrix, in row-major order (as np.triu_indices with k=1).
+    """
+    protein_pairs = np.asarray(protein_pairs, dtype=np.int64).reshape(-1, 2)
+    first, second = protein_pairs[:, 0], protein_pairs[:, 1]
+    return first * (2 * num_proteins - first - 1) // 2 + second - first - 1
+
+class ContactStateRecorder:
+    """
+    Records, frame after frame, which protein pairs are in contact, as packed bits.
+
+    The states of eight consecutive frames are packed into one byte per pair, so 100000
+    frames of 20000 protein pairs take 250 MB. The frames are packed along the time axis,
+    which keeps the time series of every pair in one column that can be unpacked on its
+    own for the time correlation analyses.
+    """
+
+    def __init__(self, num_proteins):
+        """
+        Parameters:
+        - num_proteins (int): Number of proteins.
+        """
+        self.num_proteins = num_proteins
+        self.n_pairs = num_proteins * (num_proteins - 1) // 2
+        self.n_frames = 0
+        self._packed = []                                          # Packed rows of 8 complete frames (n_pairs)
+        self._pending = np.zeros((8, self.n_pairs), dtype=bool)    # States of the frames not packed yet
+
+    def add_frame(self, protein_pairs):
+        """
+        Adds the contacts of the next frame.
+
+        Parameters:
+        - protein_pairs (np.ndarray): Indices (p, q) of the proteins in contact, with p < q
+          (n_pairs x 2).
+        """
+        row = self.n_frames % 8
+        self._pending[row] = False
+        self._pending[row, protein_pair_indices(protein_pairs, self.num_proteins)] = True
+        self.n_frames += 1
+        if row == 7:
+            self._packed.append(np.packbits(self._pending, axis=0)[0])
+
+    def packed_states(self):
+        """
+        Returns the recorded states.
+
+        Returns:
+        - packed_states (np.ndarray): Contact states packed along the frames (big-endian bit
+          order, as np.packbits), one column per protein pair (ceil(n_frames / 8) x n_pairs).
+        """
+        rows = list(self._packed)
+        if self.n_frames % 8:
+            pending = self._pending.copy()
+            pending[self.n_frames % 8:] = False
+            rows.append(np.packbits(pending, axis=0)[0])
+        return np.array(rows, dtype=np.uint8).reshape(-1, self.n_pairs)
+
+    def get_state(self):
+        """
+        Returns the recorded states as named arrays, for save_checkpoint.
+        """
+        return {
+            'parameters': np.array([self.num_proteins, self.n_frames]),
+            'packed_states': self.packed_states(),
+        }
+
+def _iter_state_chunks(packed_states, n_frames, pairs_per_chunk):
+    """
+    Unpacks the time series of the pairs that are in contact at least once, a chunk of
+    pairs at a time.
+
+    Yields:
+    - states (np.ndarray): Contact states of a chunk of pairs (n_frames x pairs_per_chunk).
+    """
+    # Pairs never in contact contribute nothing and are skipped without unpacking them
+    in_contact = np.flatnonzero(np.bitwise_or.reduce(packed_states, axis=0))
+    for chunk_start in range(0, len(in_contact), pairs_per_chunk):
+        columns = in_contact[chunk_start:chunk_start + pairs_per_chunk]
+        yield np.unpackbits(packed_states[:, columns], axis=0, count=n_frames)
+
+def contact_autocorrelation(packed_states, n_frames):
+    """
+    Computes the contact survival (intermittent) autocorrelation function
+    C(t) = <h(0) h(t)> / <h>, with h the contact state of a protein pair, averaged over
+    all pairs and time origins.
+
+    The autocorrelation of every pair comes from the power spectrum of its zero-padded
+    time series, and since the inverse transform is linear, the spectra are summed over
+    the pairs and transformed back only once.
+
+    Parameters:
+    - packed_states (np.ndarray): Packed contact states, as returned by
+      ContactStateRecorder.packed_states.
+    - n_frames (int): Number of recorded frames.
+
+    Returns:
+    - lags (np.ndarray): Time intervals in frames.
+    - autocorrelation (np.ndarray): C(t) at each time interval, 1 at t = 0, or zeros when
+      no pair is ever in contact.
+    """
+    n_fft = 2 * n_frames
+    pairs_per_chunk = max(1, FFT_CHUNK_SIZE // n_fft)
+    power_spectrum = np.zeros(n_fft // 2 + 1)
+    n_contacts = 0
+    for states in _iter_state_chunks(packed_states, n_frames, pairs_per_chunk):
+        spectrum = np.fft.rfft(states, n=n_fft, axis=0)
+        power_spectrum += np.sum(spectrum.real ** 2 + spectrum.imag ** 2, axis=1)
+        n_contacts += np.count_nonzero(states)
+
+    lags = np.arange(n_frames)
+    if n_contacts == 0:
+        return lags, np.zeros(n_frames)
+    # Sum over pairs and origins of h(t0) h(t0 + t), per time origin, relative to <h>
+    correlation_sums = np.fft.irfft(power_spectrum, n=n_fft)[:n_frames]
+    return lags, correlation_sums / (n_frames - lags) * (n_frames / n_contacts)
+
+def residence_time_distribution(packed_states, n_frames, include_truncated=False):
+    """
+    Counts the uninterrupted contact episodes of the protein pairs by duration.
+
+    Parameters:
+    - packed_states (np.ndarray): Packed contact states, as returned by
+      ContactStateRecorder.packed_states.
+    - n_frames (int): Number of recorded frames.
+    - include_truncated (bool): Whether to count the episodes that are cut by the start
+      or the end of the trajectory, whose true duration is unknown.
+
+    Returns:
+    - durations (np.ndarray): Durations in frames, 1 to n_frames.
+    - counts (np.ndarray): Number of contact episodes of each duration.
+    """
+    pairs_per_chunk = max(1, FFT_CHUNK_SIZE // (n_frames + 1))
+    counts = np.zeros(n_frames + 1, dtype=np.int64)
+    for states in _iter_state_chunks(packed_states, n_frames, pairs_per_chunk):
+        # +1 where an episode starts and -1 just after it ends, pair after pair
+        padded = np.zeros((states.shape[1], n_frames + 2), dtype=np.int8)
+        padded[:, 1:-1] = states.T
+        changes = np.diff(padded, axis=1)
+        starts = np.nonzero(changes == 1)[1]
+        ends = np.nonzero(changes == -1)[1]
+        if not include_truncated:
+            complete = (starts > 0) & (ends < n_frames)
+            starts, ends = starts[complete], ends[complete]
+        counts += np.bincount(ends - starts, minlength=n_frames + 1)
+    return np.arange(1, n_frames + 1), counts[1:]
+
+# Main script
+if __name__ == "__main__":
+    trajectory_file_path = 'trajectory.pdb'  # Input trajectory file (PDB, LAMMPS dump or DCD)
+    num_atoms_per_protein = 229   # Number of atoms per protein
+    cutoff_distance = 8.2         # Contact distance cutoff in Å
+    skin_distance = 2.0           # Verlet skin in Å
+    start_frame = 0               # First frame to analyse (e.g. to discard equilibration)
+    stop_frame = None             # Frame to stop at (None for the end of the trajectory)
+    frame_stride = 1              # Analyse every n-th frame
+    default_box_length = 500.0    # Cubic box length for frames without box information in the file
+    states_file_path = 'contact_states.npz'  # Packed contact states of every protein pair
+
+    frames = load_trajectory(trajectory_file_path, start_frame, stop_frame, frame_stride,
+                             default_box=default_box_length)
+    contact_tracker = VerletContactTracker(num_atoms_per_protein, cutoff_distance, skin_distance)
+
+    # Record the contact state of every protein pair in every frame
+    recorder = None
+    for frame_coords, box in frames:
+        if recorder is None:
+            recorder = ContactStateRecorder(len(frame_coords) // num_atoms_per_protein)
+        recorder.add_frame(contact_tracker.find_protein_pairs(frame_coords, box))
+    if recorder is None:
+        raise ValueError(f"No frames selected from {trajectory_file_path}")
+    save_checkpoint(states_file_path, **recorder.get_state())
+
+    packed_states = recorder.packed_states()
+    lags, autocorrelation = contact_autocorrelation(packed_states, recorder.n_frames)
+    durations, residence_counts = residence_time_distribution(packed_states, recorder.n_frames)
+
+    # Time intervals in frames of the full trajectory
+    with open('contact_autocorrelation.txt', 'w') as output_file:
+        output_file.write("Lag\tC(t)\n")  # Header
+        for lag, value in zip(lags, autocorrelation):
+            output_file.write(f"{lag * frame_stride}\t{value}\n")
+    with open('residence_times.txt', 'w') as output_file:
+        output_file.write("Duration\tEpisodes\n")  # Header
+        for duration, count in zip(durations, residence_counts):
+            output_file.write(f"{duration * frame_stride}\t{count}\n")
+    n_episodes = residence_counts.sum()
+    if n_episodes:
+        mean_residence_time = np.sum(durations * residence_counts) / n_episodes * frame_stride
+        print(f"{n_episodes} complete contact episodes, mean residence time {mean_residence_time:.2f} frames")
+
+    # Plot the contact survival autocorrelation and the residence time distribution
+    fig, (ax_correlation, ax_residence) = plt.subplots(1, 2, figsize=(12, 5))
+    ax_correlation.plot(lags[1:] * frame_stride, autocorrelation[1:], color='b')
+    ax_correlation.set_xscale('log')
+    ax_correlation.set_xlabel("Lag (frames)")
+    ax_correlation.set_ylabel("C(t)")
+    ax_correlation.set_title("Contact Survival Autocorrelation")
+    observed = residence_counts > 0
+    ax_residence.plot(durations[observed] * frame_stride, residence_counts[observed], 'o', color='r')
+    ax_residence.set_xscale('log')
+    ax_residence.set_yscale('log')
+    ax_residence.set_xlabel("Residence time (frames)")
+    ax_residence.set_ylabel("Number of contact episodes")
+    ax_residence.set_title("Residence Time Distribution")
+    plt.tight_layout()
+    plt.show()
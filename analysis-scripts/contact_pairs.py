@@ -0,0 +1,131 @@
+import os
+import struct
+
+import numpy as np
+
+from checkpoint import make_temp_file
+
+CONTACT_PAIRS_MAGIC = b'CPAIRS01'
+CONTACT_PAIRS_HEADER_FORMAT = '<8sqqqq'  # magic, n_frames, n_pairs, n_beads, bytes per bead index
+CONTACT_PAIRS_HEADER_SIZE = 64  # Header is padded so the pair block starts on an aligned offset
+
+def _index_dtype(n_beads):
+    """
+    Returns the smallest signed integer type (int16 or int32) that holds every bead index.
+    """
+    return np.dtype(np.int16) if n_beads <= np.iinfo(np.int16).max + 1 else np.dtype(np.int32)
+
+def _offsets_position(n_pairs, index_size):
+    """
+    Returns the position of the frame offsets in a contact pair file, after the pairs,
+    rounded up to a multiple of 8 bytes.
+    """
+    pairs_end = CONTACT_PAIRS_HEADER_SIZE + n_pairs * 2 * index_size
+    return -(-pairs_end // 8) * 8
+
+class ContactPairWriter:
+    """
+    Writes the bead pairs in contact of every frame to a compact binary file, frame after
+    frame, in a compressed sparse row layout.
+
+    The file holds a header, the pairs of all frames one after the other (n_pairs x 2,
+    int16 when every bead index fits, int32 otherwise) and the offsets of the first pair
+    of every frame (n_frames + 1, int64), so the pairs of frame k are
+    pairs[offsets[k]:offsets[k + 1]]. The pairs are streamed to a temporary file, and the
+    offsets and the final header are written on close, after which the file is renamed
+    into place; an interrupted run never leaves a partial file behind. The temporary file
+    has a unique name, so concurrent runs writing the same file do not interfere.
+    """
+
+    def __init__(self, file_path, n_beads):
+        """
+        Parameters:
+        - file_path (str): Path of the contact pair file.
+        - n_beads (int): Number of beads in every frame.
+        """
+        self.file_path = file_path
+        self.n_beads = n_beads
+        self.index_dtype = _index_dtype(n_beads)
+        self._offsets = [0]
+        self._tmp_file_path = make_temp_file(file_path)
+        self._file = open(self._tmp_file_path, 'wb')
+        self._file.write(bytes(CONTACT_PAIRS_HEADER_SIZE))
+
+    def write_frame(self, bead_pairs):
+        """
+        Appends the bead pairs in contact of the next frame.
+
+        Parameters:
+        - bead_pairs (np.ndarray): Indices (i, j) of the beads in contact (n_pairs x 2).
+        """
+        bead_pairs = np.ascontiguousarray(bead_pairs, dtype=self.index_dtype).reshape(-1, 2)
+        self._file.write(bead_pairs.tobytes())
+        self._offsets.append(self._offsets[-1] + len(bead_pairs))
+
+    def close(self):
+        """
+        Writes the frame offsets and the header, and moves the file into place.
+        """
+        if self._file.closed:
+            return
+        n_frames, n_pairs = len(self._offsets) - 1, self._offsets[-1]
+        self._file.seek(_offsets_position(n_pairs, self.index_dtype.itemsize))
+        self._file.write(np.array(self._offsets, dtype=np.int64).tobytes())
+        self._file.seek(0)
+        self._file.write(struct.pack(CONTACT_PAIRS_HEADER_FORMAT, CONTACT_PAIRS_MAGIC, n_frames, n_pairs,
+                                     self.n_beads, self.index_dtype.itemsize))
+        self._file.close()
+        os.replace(self._tmp_file_path, self.file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the previous file, if any, and drop the incomplete one
+            self._file.close()
+            os.remove(self._tmp_file_path)
+
+def open_contact_pairs(file_path):
+    """
+    Opens a contact pair file written by ContactPairWriter as read-only memory maps.
+
+    Parameters:
+    - file_path (str): Path of the contact pair file.
+
+    Returns:
+    - offsets (np.memmap): Position of the first pair of every frame, and the total
+      number of pairs at the end (n_frames + 1, int64).
+    - pairs (np.memmap): Indices (i, j) of the beads in contact, frame after frame
+      (n_pairs x 2, int16 or int32).
+    - n_beads (int): Number of beads in every frame.
+    """
+    with open(file_path, 'rb') as pair_file:
+        header = pair_file.read(struct.calcsize(CONTACT_PAIRS_HEADER_FORMAT))
+    magic, n_frames, n_pairs, n_beads, index_size = struct.unpack(CONTACT_PAIRS_HEADER_FORMAT, header)
+    offsets_position = _offsets_position(n_pairs, index_size)
+    if (magic != CONTACT_PAIRS_MAGIC or index_size not in (2, 4)
+            or os.path.getsize(file_path) != offsets_position + (n_frames + 1) * 8):
+        raise ValueError(f"{file_path} is not a contact pair file of the current format")
+
+    offsets = np.memmap(file_path, dtype=np.int64, mode='r', offset=offsets_position, shape=(n_frames + 1,))
+    # A memory map cannot be empty
+    if n_pairs == 0:
+        return offsets, np.zeros((0, 2), dtype=f'<i{index_size}'), n_beads
+    pairs = np.memmap(file_path, dtype=f'<i{index_size}', mode='r', offset=CONTACT_PAIRS_HEADER_SIZE,
+                      shape=(n_pairs, 2))
+    return offsets, pairs, n_beads
+
+def iter_contact_pairs(file_path):
+    """
+    Yields the bead pairs in contact of every frame of a contact pair file, as views of
+    its memory map.
+
+    Yields:
+    - bead_pairs (np.ndarray): Indices (i, j) of the beads in contact (n_pairs x 2).
+    """
+    offsets, pairs, _ = open_contact_pairs(file_path)
+    for frame_idx in range(len(offsets) - 1):
+        yield pairs[offsets[frame_idx]:offsets[frame_idx + 1]]
@@ -1,84 +1,108 @@
+import contextlib
+import itertools
+
 import numpy as np
 import matplotlib.pyplot as plt
 
-def parse_pdb_frames(file_path):
-    """
-    Parse a PDB file with multiple frames separated by 'END' lines.
-    Extract atomic coordinates for each frame.
-    """
-    frames = []
-    coordinates = []
-
-    with open(file_path, 'r') as file:
-        for line in file:
-            if line.startswith("ATOM"):
-                parts = line.split()
-                x, y, z = float(parts[6]), float(parts[7]), float(parts[8])
-                coordinates.append([x, y, z])
-            elif line.startswith("END"):
-                # Store the frame coordinates and reset for the next frame
-                if coordinates:
-                    frames.append(np.array(coordinates))
-                    coordinates = []
+from clusters import (cluster_size_histogram, label_clusters, write_cluster_histogram_header,
+                      write_cluster_histogram_row)
+from contact_pairs import ContactPairWriter
+from neighbors import VerletContactTracker, bead_to_protein_pairs
+from parallel import map_frame_chunks
+from trajectory import load_trajectory
 
-    # In case there is no 'END' at the end of the file
-    if coordinates:
-        frames.append(np.array(coordinates))
-
-    return frames
-
-def compute_distances(coords1, coords2):
-    """
-    Compute pairwise distances between two sets of coordinates.
+def analyse_chunk_contacts(coords, boxes, num_atoms_per_protein, cutoff, skin, keep_bead_pairs=False):
     """
-    diff = coords1[:, np.newaxis, :] - coords2[np.newaxis, :, :]
-    distances = np.sqrt(np.sum(diff**2, axis=2))
-    return distances
+    Finds the protein contacts and aggregates in each frame of a chunk of consecutive
+    frames (n_frames x N x 3, with boxes n_frames x 6), reusing one Verlet list across the
+    chunk. This is the unit of work of the frame-parallel main loop.
 
-def count_protein_contacts(coords, num_atoms_per_protein, cutoff):
+    Returns:
+    - results (list): Protein pairs in contact, cluster-size histogram and, with
+      `keep_bead_pairs`, bead pairs in contact (None otherwise) of every frame.
     """
-    Count unique contacts between proteins based on distances less than the cutoff.
-    """
-    num_proteins = len(coords) // num_atoms_per_protein
-    unique_contacts = set()
-
-    for i in range(num_proteins):
-        for j in range(i + 1, num_proteins):  # Only check each pair once
-            start_i, end_i = i * num_atoms_per_protein, (i + 1) * num_atoms_per_protein
-            start_j, end_j = j * num_atoms_per_protein, (j + 1) * num_atoms_per_protein
-            distances = compute_distances(coords[start_i:end_i], coords[start_j:end_j])
-            if np.any(distances < cutoff):
-                unique_contacts.add((i, j))
-
-    return len(unique_contacts)
+    contact_tracker = VerletContactTracker(num_atoms_per_protein, cutoff, skin)
+    num_proteins = coords.shape[1] // num_atoms_per_protein
+    results = []
+    for frame_coords, box in zip(coords, boxes):
+        bead_pairs = contact_tracker.find_bead_pairs(frame_coords, box)
+        protein_pairs = bead_to_protein_pairs(bead_pairs, num_atoms_per_protein, num_proteins)
+        # Aggregates are the connected components of the protein contact graph
+        cluster_histogram = cluster_size_histogram(label_clusters(protein_pairs, num_proteins))
+        results.append((protein_pairs, cluster_histogram, bead_pairs if keep_bead_pairs else None))
+    return results
 
 # Main script
 if __name__ == "__main__":
-    pdb_file_path = 'trajectory.pdb'  # Input PDB trajectory file
+    trajectory_file_path = 'trajectory.pdb'  # Input trajectory file (PDB, LAMMPS dump or DCD)
     num_atoms_per_protein = 229   # Number of atoms per protein
     cutoff_distance = 8.2         # Contact distance cutoff in Å
+    start_frame = 0               # First frame to analyse (e.g. to discard equilibration)
+    stop_frame = None             # Frame to stop at (None for the end of the trajectory)
+    frame_stride = 1              # Analyse every n-th frame
+    default_box_length = 500.0    # Cubic box length for frames without box information in the file
+    skin_distance = 2.0           # Verlet skin in Å: the contact list is only rebuilt once a bead has moved skin/2
+    n_workers = None              # Processes analysing frames in parallel (None for all cores, 1 for none)
+    contact_pairs_file_path = None  # File for the bead pairs in contact of every frame (e.g. 'contact_pairs.bin'), or None
+
+    # Memory-map the selected frames and their boxes from the binary cache of the trajectory
+    # (compressed trajectories are streamed instead)
+    frames = load_trajectory(trajectory_file_path, start_frame, stop_frame, frame_stride,
+                             default_box=default_box_length)
 
-    # Parse the PDB file into frames
-    frames = parse_pdb_frames(pdb_file_path)
+    # The number of beads sizes the contact pair file; only the length of the first frame is
+    # kept, since streamed frames share one buffer
+    frames = iter(frames)
+    first_frame = next(frames, None)
+    num_beads = 0 if first_frame is None else len(first_frame[0])
+    if first_frame is not None:
+        frames = itertools.chain([first_frame], frames)
 
-    # Calculate contacts for each frame and store the results
+    # Chunks of consecutive frames are analysed in parallel and their results come back in order.
+    # Within a chunk, contacts are re-tested only among the pairs of a Verlet list, rebuilt when
+    # beads have moved too far
+    chunk_results = map_frame_chunks(analyse_chunk_contacts, frames,
+                                     (num_atoms_per_protein, cutoff_distance, skin_distance,
+                                      contact_pairs_file_path is not None), n_workers)
+    frame_results = (result for chunk_result in chunk_results for result in chunk_result)
+
+    # Calculate contacts and aggregates for each frame and store the results
     contacts_over_time = []
+    frame_numbers = []
     output_file_path = 'contacts_over_time.txt'
+    cluster_file_path = 'cluster_sizes_over_time.txt'  # Number of clusters of each size per frame
+
+    with contextlib.ExitStack() as output_files:
+        output_file = output_files.enter_context(open(output_file_path, 'w'))
+        cluster_file = output_files.enter_context(open(cluster_file_path, 'w'))
+        # Optionally keep the bead pairs themselves, for later analyses without the coordinates
+        pair_writer = None
+        if contact_pairs_file_path is not None:
+            pair_writer = output_files.enter_context(ContactPairWriter(contact_pairs_file_path, num_beads))
 
-    with open(output_file_path, 'w') as output_file:
         output_file.write("Frame\tContacts\n")  # Header
 
-        for frame_idx, frame_coords in enumerate(frames):
-            contacts_count = count_protein_contacts(frame_coords, num_atoms_per_protein, cutoff_distance)
+        for frame_idx, (protein_pairs, cluster_histogram, bead_pairs) in enumerate(frame_results):
+            frame_number = start_frame + frame_idx * frame_stride + 1  # Frame number in the full trajectory
+            contacts_count = len(protein_pairs)
             contacts_over_time.append(contacts_count)
-            print(f"Frame {frame_idx + 1}: {contacts_count} contacts")
+            frame_numbers.append(frame_number)
+
+            num_proteins = len(cluster_histogram)
+            largest_cluster = np.flatnonzero(cluster_histogram)[-1] + 1 if num_proteins else 0
+            print(f"Frame {frame_number}: {contacts_count} contacts, largest cluster {largest_cluster}")
 
-            # Write frame and contact count to the file
-            output_file.write(f"{frame_idx + 1}\t{contacts_count}\n")
+            # Write frame and contact count to the file, and the cluster sizes to their own file
+            output_file.write(f"{frame_number}\t{contacts_count}\n")
+            if frame_idx == 0:
+                write_cluster_histogram_header(cluster_file, num_proteins)
+            write_cluster_histogram_row(cluster_file, frame_number, cluster_histogram)
+            if pair_writer is not None:
+                pair_writer.write_frame(bead_pairs)
 
     # Plot the contacts over time
     plt.figure(figsize=(10, 6))
-    plt.plot(range(1, len(contacts_over_time) + 1), contacts_over_time, marker='o', color='b')
+    plt.plot(frame_numbers, contacts_over_time, marker='o', color='b')
     plt.xlabel("Frame")
     plt.ylabel("Number of Contacts")
     plt.title("Protein Contacts Over Time")
@@ -0,0 +1,137 @@
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+BOOTSTRAP_CHUNK_SIZE = 4096  # Values (e.g. time intervals) resampled by one task of the process pool
+
+def normal_quantile(confidence):
+    """
+    Returns the number of standard errors spanned by a two-sided confidence interval
+    under the normal approximation (1.96 for 95%).
+    """
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+def fit_diffusion_coefficient(time, msd, fit_range=None, dimensions=3):
+    """
+    Fits the Einstein relation MSD(t) = 2 d D t + c to one or many MSD curves.
+
+    The least-squares slope is computed in closed form for all curves at once. Values
+    that are not finite (e.g. intervals longer than a block) are left out of the fit.
+
+    Parameters:
+    - time (np.ndarray): Time intervals (n_lags).
+    - msd (np.ndarray): MSD curves (... x n_lags).
+    - fit_range (tuple): Smallest and largest time interval included in the fit, or None
+      for all of them.
+    - dimensions (int): Number of dimensions d of the displacements.
+
+    Returns:
+    - diffusion (np.ndarray): Diffusion coefficient of each curve (...), in squared
+      length units of the MSD per unit of time.
+    """
+    time = np.asarray(time, dtype=np.float64)
+    msd = np.asarray(msd, dtype=np.float64)
+    selected = np.isfinite(msd)
+    if fit_range is not None:
+        selected &= (time >= fit_range[0]) & (time <= fit_range[1])
+
+    weights = selected.astype(np.float64)
+    msd = np.where(selected, msd, 0)
+    n_points = weights.sum(axis=-1)
+    mean_time = (weights * time).sum(axis=-1) / n_points
+    mean_msd = (weights * msd).sum(axis=-1) / n_points
+    centred_time = time - mean_time[..., np.newaxis]
+    slope = ((weights * centred_time * (msd - mean_msd[..., np.newaxis])).sum(axis=-1)
+             / (weights * centred_time ** 2).sum(axis=-1))
+    return slope / (2 * dimensions)
+
+def block_average(block_values, confidence=0.95):
+    """
+    Estimates the mean and its confidence interval from independent blocks.
+
+    Each block is a contiguous part of the trajectory, long enough for its values to be
+    uncorrelated with those of the other blocks, so the spread between block values
+    accounts for the time correlation within the trajectory.
+
+    Parameters:
+    - block_values (np.ndarray): One value, or array of values, per block (n_blocks x ...).
+    - confidence (float): Confidence level of the interval.
+
+    Returns:
+    - mean (np.ndarray): Mean over the blocks.
+    - standard_error (np.ndarray): Standard error of the mean.
+    - low, high (np.ndarray): Bounds of the confidence interval (normal approximation).
+    """
+    block_values = np.asarray(block_values, dtype=np.float64)
+    n_blocks = len(block_values)
+    mean = block_values.mean(axis=0)
+    standard_error = block_values.std(axis=0, ddof=1) / np.sqrt(n_blocks)
+    half_width = normal_quantile(confidence) * standard_error
+    return mean, standard_error, mean - half_width, mean + half_width
+
+def _bootstrap_chunk(samples, counts, confidence, with_interval):
+    """
+    Worker for bootstrap_mean: resamples a block of values for all replicas at once.
+
+    Every replica is a weighted mean of the samples, with the number of times each sample
+    was drawn as its weight, so all replicas come from a single matrix product.
+    """
+    replicas = counts @ samples / counts.shape[1]
+    if not with_interval:
+        return replicas.std(axis=0, ddof=1), None, None
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(replicas, [tail, 1 - tail], axis=0)
+    return replicas.std(axis=0, ddof=1), low, high
+
+def bootstrap_mean(samples, n_replicas=1000, confidence=0.95, n_workers=None, seed=None, with_interval=True):
+    """
+    Estimates the mean of independent samples and its bootstrap confidence interval.
+
+    The samples are drawn with replacement `n_replicas` times. The values are split into
+    chunks that are resampled in a process pool, with the same draws for every chunk.
+    Sorting the replicas for the percentiles costs far more than the resampling itself,
+    so it can be skipped when only the standard error is needed.
+
+    Parameters:
+    - samples (np.ndarray): Independent samples, e.g. one MSD curve per protein
+      (n_samples x n_values), or one value per sample (n_samples).
+    - n_replicas (int): Number of bootstrap replicas.
+    - confidence (float): Confidence level of the percentile interval.
+    - n_workers (int): Number of processes (None for all cores, 1 to run in-process).
+    - seed (int): Seed of the random draws, for reproducible intervals.
+    - with_interval (bool): Whether to compute the percentile interval.
+
+    Returns:
+    - mean (np.ndarray): Mean of the samples.
+    - standard_error (np.ndarray): Standard deviation of the replica means.
+    - low, high (np.ndarray): Percentile confidence interval of the mean, or None
+      without `with_interval`.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    values = samples.reshape(len(samples), -1)
+    n_samples, n_values = values.shape
+
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(n_samples, np.full(n_samples, 1 / n_samples), size=n_replicas).astype(np.float64)
+
+    chunk_starts = range(0, n_values, BOOTSTRAP_CHUNK_SIZE)
+    chunks = [values[:, chunk_start:chunk_start + BOOTSTRAP_CHUNK_SIZE] for chunk_start in chunk_starts]
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(chunks))
+    if n_workers <= 1:
+        results = [_bootstrap_chunk(chunk, counts, confidence, with_interval) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            results = list(executor.map(_bootstrap_chunk, chunks, [counts] * len(chunks),
+                                        [confidence] * len(chunks), [with_interval] * len(chunks)))
+
+    standard_errors, lows, highs = zip(*results)
+    mean = values.mean(axis=0).reshape(samples.shape[1:])
+    standard_error = np.concatenate(standard_errors).reshape(samples.shape[1:])
+    if not with_interval:
+        return mean, standard_error, None, None
+    return mean, standard_error, np.concatenate(lows).reshape(samples.shape[1:]), np.concatenate(highs).reshape(samples.shape[1:])
@@ -1,127 +1,526 @@
+import os
+
 import numpy as np
 import matplotlib.pyplot as plt
 
-# Define the simulation box length and half its size for periodic boundary condition corrections
-BOX_LENGTH = 500.0  # Length of the simulation box (assumed cubic)
-HALF_BOX_LENGTH = BOX_LENGTH / 2  # Half-box length for PBC handling
+from checkpoint import check_trajectory_identity, load_checkpoint, save_checkpoint, trajectory_identity
+from error_analysis import block_average, bootstrap_mean, fit_diffusion_coefficient, normal_quantile
+from online_msd import OnlineMSD
+from pbc import iter_unwrapped_chunks, unwrap_trajectory
+from trajectory import load_trajectory
+
+LAG_SCHEDULES = ('linear', 'log', 'multi-tau')  # Time intervals at which the MSD is computed
+ERROR_METHODS = ('atoms', 'blocks', 'bootstrap')  # Estimates of the statistical error of the MSD
+VAN_HOVE_BINS = 200  # Number of bins of the self van Hove distributions
+
+def compute_msd_fft(positions):
+    """
+    Computes the MSD of every atom for all time intervals with the FFT
+    (Wiener-Khinchin) algorithm, averaging over all time origins.
+    
+    The MSD at interval m is split into S1(m) - 2 S2(m), where S1 is built from
+    running sums of the squared positions and S2 is the position autocorrelation,
+    obtained for all intervals at once with a zero-padded FFT. The cost is
+    O(T log T) per atom instead of O(T^2).
+    
+    Parameters:
+    - positions (np.ndarray): Unwrapped atomic positions for every frame (n_frames x N x 3).
+    
+    Returns:
+    - msd (np.ndarray): MSD for each atom at time intervals 0 to n_frames-1 (N x n_frames).
+    """
+    n_frames = len(positions)
+    # The MSD does not depend on the origin; centring keeps S1 - 2 S2 free of cancellation errors
+    positions = positions - positions.mean(axis=0)
+    n_time_origins = np.arange(n_frames, 0, -1)[:, np.newaxis]  # n_frames - m for each interval m
+
+    # S1(m) = sum over origins k of |r(k+m)|^2 + |r(k)|^2, from prefix sums of |r|^2
+    squared_norms = np.sum(positions ** 2, axis=2)
+    prefix_sums = np.zeros((n_frames + 1, positions.shape[1]))
+    np.cumsum(squared_norms, axis=0, out=prefix_sums[1:])
+    intervals = np.arange(n_frames)
+    s1 = (prefix_sums[-1] - prefix_sums[intervals] + prefix_sums[n_frames - intervals]) / n_time_origins
+
+    # S2(m) = sum over origins k of r(k+m) . r(k), one dimension at a time to bound memory
+    n_fft = 2 * n_frames
+    s2 = np.zeros((n_frames, positions.shape[1]))
+    for dim in range(3):
+        spectrum = np.fft.rfft(positions[:, :, dim], n=n_fft, axis=0)
+        s2 += np.fft.irfft(spectrum * spectrum.conj(), n=n_fft, axis=0)[:n_frames]
+    s2 /= n_time_origins
+
+    return (s1 - 2 * s2).T
 
-def parse_pdb_frames(file_path):
+def log_spaced_lags(n_frames, n_lags):
     """
-    Reads a PDB trajectory file and extracts atomic positions for each frame.
+    Selects about `n_lags` distinct time intervals between 1 and n_frames-1, evenly
+    spaced on a logarithmic scale.
     
     Parameters:
-    - file_path (str): Path to the PDB file.
+    - n_frames (int): Number of frames in the trajectory.
+    - n_lags (int): Number of time intervals requested.
     
     Returns:
-    - frames (list of np.ndarray): List of frames, where each frame is an array of atomic positions (N x 3).
+    - lags (np.ndarray): Sorted, distinct time intervals in frames.
     """
-    frames = []
-    current_frame = []
+    if n_frames < 2:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.round(np.geomspace(1, n_frames - 1, n_lags)).astype(np.int64))
 
-    with open(file_path, 'r') as file:
-        for line in file:
-            if line.startswith("ATOM"):  # Extract atomic coordinates from 'ATOM' lines
-                x = float(line[30:38].strip())
-                y = float(line[38:46].strip())
-                z = float(line[46:54].strip())
-                current_frame.append([x, y, z])
-            elif line.startswith("END"):  # Identify end of a frame and store it
-                frames.append(np.array(current_frame))
-                current_frame = []
+def compute_msd_at_lags(positions, lags):
+    """
+    Computes the MSD of every atom at the given time intervals, averaging over all time
+    origins.
+    
+    As in compute_msd_fft, the MSD is split into S1(m) - 2 S2(m). S1 comes from prefix
+    sums of the squared positions, and S2 is a single dot product over the trajectory
+    for each interval, so each interval costs one read-only pass over the positions.
+    
+    Parameters:
+    - positions (np.ndarray): Unwrapped atomic positions for every frame (n_frames x N x 3).
+    - lags (np.ndarray): Time intervals in frames (1 to n_frames-1).
+    
+    Returns:
+    - msd (np.ndarray): MSD for each atom at each time interval (N x n_lags).
+    """
+    n_frames = len(positions)
+    positions = positions - positions.mean(axis=0)
+    prefix_sums = np.zeros((n_frames + 1, positions.shape[1]))
+    np.cumsum(np.sum(positions ** 2, axis=2), axis=0, out=prefix_sums[1:])
+
+    msd = np.empty((positions.shape[1], len(lags)))
+    for lag_index, lag in enumerate(lags):
+        s1 = prefix_sums[-1] - prefix_sums[lag] + prefix_sums[n_frames - lag]
+        s2 = np.einsum('tnd,tnd->n', positions[lag:], positions[:-lag])
+        msd[:, lag_index] = (s1 - 2 * s2) / (n_frames - lag)
+    return msd
+
+def compute_msd_multi_tau(positions, points_per_level=16, block_size=2):
+    """
+    Computes the MSD of every atom with a multi-tau correlator.
+    
+    The first level uses the frames as they are, for intervals 1 to points_per_level-1.
+    Each following level averages `block_size` consecutive positions of the previous one
+    and covers intervals points_per_level/block_size to points_per_level-1 in units of
+    its coarser time step. The intervals are therefore spaced roughly logarithmically,
+    and the total cost grows linearly with the number of frames. Averaging the positions
+    slightly lowers the MSD at the shortest intervals of each coarse level.
+    
+    Parameters:
+    - positions (np.ndarray): Unwrapped atomic positions for every frame (n_frames x N x 3).
+    - points_per_level (int): Number of time intervals per level.
+    - block_size (int): Number of positions averaged from one level to the next.
     
-    return frames
+    Returns:
+    - lags (np.ndarray): Time intervals in frames.
+    - msd (np.ndarray): MSD for each atom at each time interval (N x n_lags).
+    """
+    lags = []
+    msd_columns = []
+    coarse_positions = positions
+    level_step = 1
+    first_lag = 1
+    while len(coarse_positions) > first_lag:
+        level_lags = np.arange(first_lag, min(points_per_level, len(coarse_positions)))
+        msd_columns.append(compute_msd_at_lags(coarse_positions, level_lags))
+        lags.extend(level_lags * level_step)
+
+        # Block averages of the current level form the next, coarser level
+        n_blocks = len(coarse_positions) // block_size
+        coarse_positions = coarse_positions[:n_blocks * block_size].reshape(
+            (n_blocks, block_size) + coarse_positions.shape[1:]).mean(axis=1)
+        level_step *= block_size
+        first_lag = points_per_level // block_size
+
+    msd = np.concatenate(msd_columns, axis=1) if msd_columns else np.zeros((positions.shape[1], 0))
+    return np.array(lags, dtype=np.int64), msd
 
-def compute_msd(atom_positions):
+def compute_displacement_distributions(positions, lags, van_hove_bins=VAN_HOVE_BINS, van_hove_max_distance=None):
     """
-    Computes the mean squared displacement (MSD) between two atomic positions,
-    applying periodic boundary corrections if necessary.
+    Computes the second and fourth moments of the displacements of every atom and the
+    self van Hove distribution at the given time intervals.
+    
+    The squared displacement lengths of each interval are computed once and feed all
+    three observables, in one pass over the trajectory per interval.
     
     Parameters:
-    - atom_positions (np.ndarray): Array containing two atomic positions (2 x 3).
+    - positions (np.ndarray): Unwrapped atomic positions for every frame (n_frames x N x 3).
+    - lags (np.ndarray): Time intervals in frames (1 to n_frames-1).
+    - van_hove_bins (int): Number of bins of the van Hove distributions.
+    - van_hove_max_distance (float): Upper edge of the bins, or None for the longest
+      displacement at the longest interval. Longer displacements are counted in the
+      normalization only.
     
     Returns:
-    - msd (float): The squared displacement between the two positions.
+    - msd (np.ndarray): MSD for each atom at each time interval (N x n_lags).
+    - fourth_moment (np.ndarray): Mean fourth power of the displacement length for each
+      atom at each time interval (N x n_lags).
+    - van_hove (np.ndarray): Probability density of the displacement length, 4 pi r^2 Gs(r, t),
+      at each time interval (n_lags x van_hove_bins).
+    - bin_edges (np.ndarray): Edges of the van Hove bins.
     """
-    corrected_positions = np.copy(atom_positions)
+    lags = np.asarray(lags)
+    n_frames, n_atoms = positions.shape[:2]
+    if len(lags) and (lags.min() < 1 or lags.max() >= n_frames):
+        raise ValueError(f"Time intervals must be between 1 and {n_frames - 1} frames, "
+                         f"got {lags.min()} to {lags.max()}")
+    msd = np.empty((n_atoms, len(lags)))
+    fourth_moment = np.empty((n_atoms, len(lags)))
+    van_hove = np.empty((len(lags), van_hove_bins))
+    bin_edges = None
+
+    # The longest interval comes first, so that it can set the range of the bins
+    for lag_index in np.argsort(lags)[::-1]:
+        lag = lags[lag_index]
+        displacements = positions[lag:] - positions[:-lag]
+        squared_lengths = np.einsum('tnd,tnd->tn', displacements, displacements)
+        msd[:, lag_index] = squared_lengths.mean(axis=0)
+        fourth_moment[:, lag_index] = np.einsum('tn,tn->n', squared_lengths, squared_lengths) / len(squared_lengths)
+
+        lengths = np.sqrt(squared_lengths)
+        if bin_edges is None:
+            if van_hove_max_distance is None:
+                van_hove_max_distance = lengths.max()
+            bin_edges = np.linspace(0, van_hove_max_distance, van_hove_bins + 1)
+        counts, _ = np.histogram(lengths, van_hove_bins, (0, van_hove_max_distance))
+        van_hove[lag_index] = counts / (lengths.size * np.diff(bin_edges))
+
+    return msd, fourth_moment, van_hove, bin_edges
+
+def non_gaussian_parameter(msd, fourth_moment):
+    """
+    Computes the non-Gaussian parameter alpha2 = 3 <r^4> / (5 <r^2>^2) - 1, averaged over
+    all atoms. It is zero for Gaussian (Fickian) displacements and grows with the
+    heterogeneity of the dynamics.
     
-    # Apply periodic boundary corrections
-    for j in range(3):  # Loop over x, y, z coordinates
-        delta = atom_positions[0, j] - atom_positions[1, j]
-        if delta > HALF_BOX_LENGTH:
-            corrected_positions[0, j] -= BOX_LENGTH
-        elif delta < -HALF_BOX_LENGTH:
-            corrected_positions[0, j] += BOX_LENGTH
+    Parameters:
+    - msd, fourth_moment (np.ndarray): Second and fourth displacement moments of each
+      atom at each time interval (N x n_lags).
+    
+    Returns:
+    - alpha2 (np.ndarray): Non-Gaussian parameter at each time interval.
+    """
+    return 3 * fourth_moment.mean(axis=0) / (5 * msd.mean(axis=0) ** 2) - 1
+
+def summarize_msd(msd_all_frames):
+    """
+    Averages the MSD across all atoms, with the spread between atoms as propagated error.
     
-    # Compute squared displacement
-    msd_value = np.sum((corrected_positions[0] - corrected_positions[1]) ** 2)
+    Parameters:
+    - msd_all_frames (np.ndarray): MSD values for each atom at different time intervals.
     
-    return msd_value
+    Returns:
+    - avg_msd (np.ndarray): Average MSD over all atoms at each time interval.
+    - propagated_error_per_time (np.ndarray): Error in MSD calculations.
+    """
+    n_atoms = msd_all_frames.shape[0]
+    return msd_all_frames.mean(axis=0), np.sqrt(msd_all_frames.var(axis=0) / n_atoms)
 
-def calculate_msd_rolling_average(frames):
+def compute_block_msd(positions, lags, n_blocks):
+    """
+    Computes the MSD averaged over all atoms separately in consecutive time blocks.
+    
+    The blocks are stacked along the atom axis, so all of them are handled by a single
+    call of compute_msd_fft when the intervals are all those that fit in a block (the
+    'linear' schedule), or of compute_msd_at_lags for sparser intervals.
+    
+    Parameters:
+    - positions (np.ndarray): Unwrapped atomic positions for every frame (n_frames x N x 3).
+    - lags (np.ndarray): Time intervals in frames.
+    - n_blocks (int): Number of blocks the trajectory is split into.
+    
+    Returns:
+    - block_msd (np.ndarray): Average MSD of each block at each time interval
+      (n_blocks x n_lags), NaN for intervals that do not fit in a block.
+    """
+    block_length = len(positions) // n_blocks
+    n_atoms = positions.shape[1]
+    blocks = positions[:n_blocks * block_length].reshape(n_blocks, block_length, n_atoms, 3)
+    stacked_blocks = blocks.transpose(1, 0, 2, 3).reshape(block_length, n_blocks * n_atoms, 3)
+
+    block_msd = np.full((n_blocks, len(lags)), np.nan)
+    fitting = lags < block_length
+    if np.array_equal(lags[fitting], np.arange(1, block_length)):
+        # One pass per interval would cost O(T^2) for every interval of the trajectory
+        msd = compute_msd_fft(stacked_blocks)[:, 1:]
+    else:
+        msd = compute_msd_at_lags(stacked_blocks, lags[fitting])
+    block_msd[:, fitting] = msd.reshape(n_blocks, n_atoms, -1).mean(axis=1)
+    return block_msd
+
+def calculate_msd_errors(lags, msd_all_frames, block_msd=None, error_method='atoms', n_replicas=1000,
+                         confidence=0.95, fit_range=None, n_workers=None):
+    """
+    Estimates the error of the average MSD and the diffusion coefficient with its
+    confidence interval.
+    
+    - 'atoms': spread between atoms divided by sqrt(N), as before; this ignores the time
+      correlation within the trajectory.
+    - 'blocks': spread between the MSDs of consecutive time blocks (block averaging). Only
+      intervals shorter than a block have an error (NaN for the others), and the
+      diffusion coefficient and its interval are both fitted over those intervals.
+    - 'bootstrap': bootstrap over atoms (see error_analysis.bootstrap_mean).
+    
+    The diffusion coefficient comes from a linear fit of the average MSD. Since the fit is
+    linear in the MSD, the fit of a resampled average equals the average of the fits of
+    the resampled atoms, so the atoms are fitted once and only their coefficients are
+    resampled.
+    
+    Parameters:
+    - lags (np.ndarray): Time intervals in frames.
+    - msd_all_frames (np.ndarray): MSD values for each atom at different time intervals.
+    - block_msd (np.ndarray): Average MSD of each time block, from compute_block_msd.
+      Required for 'blocks'.
+    - error_method (str): One of ERROR_METHODS.
+    - n_replicas (int): Number of bootstrap replicas.
+    - confidence (float): Confidence level of the interval of the diffusion coefficient.
+    - fit_range (tuple): Smallest and largest time interval (frames) of the fit, or None.
+    - n_workers (int): Number of processes for the bootstrap (None for all cores).
+    
+    Returns:
+    - avg_msd (np.ndarray): Average MSD over all atoms at each time interval.
+    - error_per_time (np.ndarray): Standard error of the average MSD.
+    - diffusion (tuple): Diffusion coefficient in Å^2 per frame, and the low and high
+      bounds of its confidence interval.
+    """
+    if error_method not in ERROR_METHODS:
+        raise ValueError(f"Unknown error method {error_method!r}, expected one of {ERROR_METHODS}")
+
+    avg_msd, error_per_time = summarize_msd(msd_all_frames)
+    if error_method == 'blocks':
+        if block_msd is None:
+            raise ValueError("Block averaging needs the MSD of every block (compute_block_msd)")
+        # The estimate is fitted over the same intervals as the blocks, which its interval comes from
+        in_blocks = np.all(np.isfinite(block_msd), axis=0)
+        atom_diffusion = fit_diffusion_coefficient(lags[in_blocks], msd_all_frames[:, in_blocks], fit_range)
+    else:
+        atom_diffusion = fit_diffusion_coefficient(lags, msd_all_frames, fit_range)
+    diffusion = atom_diffusion.mean()
+
+    if error_method == 'atoms':
+        half_width = normal_quantile(confidence) * atom_diffusion.std() / np.sqrt(len(atom_diffusion))
+        return avg_msd, error_per_time, (diffusion, diffusion - half_width, diffusion + half_width)
+
+    if error_method == 'blocks':
+        _, error_per_time, _, _ = block_average(block_msd, confidence)
+        _, diffusion_error, _, _ = block_average(fit_diffusion_coefficient(lags, block_msd, fit_range), confidence)
+        half_width = normal_quantile(confidence) * diffusion_error
+        return avg_msd, error_per_time, (diffusion, diffusion - half_width, diffusion + half_width)
+
+    _, error_per_time, _, _ = bootstrap_mean(msd_all_frames, n_replicas, confidence, n_workers, with_interval=False)
+    _, _, diffusion_low, diffusion_high = bootstrap_mean(atom_diffusion, n_replicas, confidence, n_workers=1)
+    return avg_msd, error_per_time, (diffusion, float(diffusion_low), float(diffusion_high))
+
+def calculate_msd_rolling_average(frames, lag_schedule='linear', n_lags=100, points_per_level=16, block_size=2,
+                                  error_method='atoms', n_blocks=10, distribution_lags=None,
+                                  van_hove_bins=VAN_HOVE_BINS, van_hove_max_distance=None, **error_options):
     """
     Computes the MSD over increasing time intervals and calculates propagated errors.
     
+    The trajectory is unwrapped once, with the box of every frame, and the MSD of all
+    atoms is averaged over every time origin (rolling average). With the 'linear'
+    schedule every interval is computed with the FFT algorithm; 'log' computes `n_lags`
+    log-spaced intervals directly, and 'multi-tau' uses compute_msd_multi_tau. The errors
+    and the diffusion coefficient come from calculate_msd_errors. For the intervals in
+    `distribution_lags`, the non-Gaussian parameter and van Hove distributions are
+    computed from the same unwrapped positions.
+    
     Parameters:
-    - frames (list of np.ndarray): List of atomic position frames.
+    - frames (iterable): Pairs of wrapped atomic positions (N x 3) and box (a, b, c,
+      alpha, beta, gamma) for every frame, as returned by load_trajectory.
+    - lag_schedule (str): One of LAG_SCHEDULES.
+    - n_lags (int): Number of time intervals of the 'log' schedule.
+    - points_per_level, block_size (int): Parameters of the 'multi-tau' schedule.
+    - error_method (str): One of ERROR_METHODS.
+    - n_blocks (int): Number of time blocks for the 'blocks' method.
+    - distribution_lags (np.ndarray): Time intervals (frames) of the displacement
+      distributions, or None to skip them.
+    - van_hove_bins, van_hove_max_distance: Binning of the van Hove distributions.
+    - error_options: Further options of calculate_msd_errors (n_replicas, confidence,
+      fit_range, n_workers).
     
     Returns:
+    - lags (np.ndarray): Time intervals in frames.
     - msd_all_frames (np.ndarray): MSD values for each atom at different time intervals.
     - avg_msd (np.ndarray): Average MSD over all atoms at each time interval.
     - propagated_error_per_time (np.ndarray): Error in MSD calculations.
+    - diffusion (tuple): Diffusion coefficient (Å^2 per frame) and its confidence interval.
+    - distributions (tuple): Time intervals, non-Gaussian parameter, van Hove
+      distributions and their bin edges (see compute_displacement_distributions), or None.
     """
-    n_frames = len(frames)
-    n_atoms = len(frames[0])
+    if lag_schedule not in LAG_SCHEDULES:
+        raise ValueError(f"Unknown lag schedule {lag_schedule!r}, expected one of {LAG_SCHEDULES}")
 
-    msd_all_frames = []  # MSD for each atom over time intervals
-    avg_msd_per_time = []  # Average MSD per time interval
-    propagated_error_per_time = []  # Error propagation per time interval
+    positions = unwrap_trajectory(frames)
+    n_frames = len(positions)
 
-    for t in range(1, n_frames):  # Time intervals from 1 to n_frames-1
-        msd_per_time_per_atom = []
+    if lag_schedule == 'linear':
+        # MSD for each atom at time intervals 1 to n_frames-1
+        lags = np.arange(1, n_frames)
+        msd_all_frames = compute_msd_fft(positions)[:, 1:]
+    elif lag_schedule == 'log':
+        lags = log_spaced_lags(n_frames, n_lags)
+        msd_all_frames = compute_msd_at_lags(positions, lags)
+    else:
+        lags, msd_all_frames = compute_msd_multi_tau(positions, points_per_level, block_size)
 
-        for atom_index in range(n_atoms):
-            msd_intervals = []
-            
-            for start in range(n_frames - t):  # Compute MSD at intervals of length `t`
-                ref = start
-                target = start + t
-                atom_positions = np.array([frames[target][atom_index], frames[ref][atom_index]])
-                msd_value = compute_msd(atom_positions)
-                msd_intervals.append(msd_value)
+    block_msd = compute_block_msd(positions, lags, n_blocks) if error_method == 'blocks' else None
+    avg_msd_per_time, propagated_error_per_time, diffusion = calculate_msd_errors(
+        lags, msd_all_frames, block_msd, error_method, **error_options)
 
-            # Compute mean and standard error for the MSD at this atom and time interval
-            mean_msd_atom = np.mean(msd_intervals)
-            error_msd_atom = np.std(msd_intervals) / np.sqrt(len(msd_intervals))
-            msd_per_time_per_atom.append((mean_msd_atom, error_msd_atom))
+    distributions = None
+    if distribution_lags is not None:
+        distribution_lags = np.asarray(distribution_lags)
+        distribution_msd, fourth_moment, van_hove, bin_edges = compute_displacement_distributions(
+            positions, distribution_lags, van_hove_bins, van_hove_max_distance)
+        distributions = (distribution_lags, non_gaussian_parameter(distribution_msd, fourth_moment),
+                         van_hove, bin_edges)
 
-        # Compute average MSD across all atoms at this time interval
-        mean_msds = [msd[0] for msd in msd_per_time_per_atom]
-        errors = [msd[1] for msd in msd_per_time_per_atom]
-        avg_msd_per_time.append(np.mean(mean_msds))
+    return lags, msd_all_frames, avg_msd_per_time, propagated_error_per_time, diffusion, distributions
 
-        # Calculate propagated error
-        squared_diffs = [(mean_msd - np.mean(mean_msds)) ** 2 for mean_msd in mean_msds]
-        variance = np.mean(squared_diffs)
-        propagated_error = np.sqrt(variance / n_atoms)
+def save_msd(time, avg_msd, error_per_time, output_file_path='msd_calvados_sc.txt'):
+    """
+    Saves the average MSD and its error at each time to a text file.
+    """
+    with open(output_file_path, 'w') as output_file:
+        for i in range(len(time)):
+            output_file.write(f"{time[i]}\t{avg_msd[i]}\t{error_per_time[i]}\n")
 
-        propagated_error_per_time.append(propagated_error)
+def save_distributions(time, alpha2, van_hove, bin_edges, non_gaussian_file_path='non_gaussian_calvados_sc.txt',
+                       van_hove_file_path='van_hove_calvados_sc.txt'):
+    """
+    Saves the non-Gaussian parameter at each time, and the van Hove distributions with
+    one column per time and one row per bin centre.
+    """
+    with open(non_gaussian_file_path, 'w') as output_file:
+        for i in range(len(time)):
+            output_file.write(f"{time[i]}\t{alpha2[i]}\n")
 
-        msd_all_frames.append(mean_msds)
+    if van_hove is None:
+        return
+    bin_centres = (bin_edges[1:] + bin_edges[:-1]) / 2
+    with open(van_hove_file_path, 'w') as output_file:
+        output_file.write("r\t" + "\t".join(f"t={t}" for t in time) + "\n")
+        for bin_index, r in enumerate(bin_centres):
+            output_file.write(f"{r}\t" + "\t".join(str(value) for value in van_hove[:, bin_index]) + "\n")
 
-        print(f"Completed computation for time interval {t}")
+def calculate_msd_online(trajectory_file_path, start_frame=0, stop_frame=None, frame_stride=1,
+                         points_per_level=16, block_size=2, default_box=None, checkpoint_file_path=None,
+                         checkpoint_interval=10000, report_interval=10000, distribution_lags=None,
+                         van_hove_bins=VAN_HOVE_BINS, van_hove_max_distance=None):
+    """
+    Computes the MSD while the trajectory is streamed, without holding it in memory.
+    
+    The frames are unwrapped chunk by chunk and added to an OnlineMSD accumulator with
+    multi-tau buffers, so memory stays bounded for any trajectory length. Every
+    `report_interval` frames the running estimate is printed and written to the output
+    file. Every `checkpoint_interval` frames, and at the end, the state is saved to
+    `checkpoint_file_path`; if that file exists, the analysis resumes from it, provided it
+    was written with the same frame selection, trajectory and accumulator parameters.
+    
+    The fourth displacement moments are accumulated alongside the MSD, and with
+    `distribution_lags` the van Hove histograms of every multi-tau interval too; the
+    distributions are returned at the multi-tau intervals closest to those requested.
+    
+    Parameters:
+    - trajectory_file_path (str): Path to the trajectory.
+    - start_frame, stop_frame, frame_stride (int): Frame selection, as for load_trajectory.
+      start_frame must not be negative when resuming.
+    - points_per_level, block_size (int): Parameters of the multi-tau buffers.
+    - default_box (float or np.ndarray): Box for frames without box information.
+    - checkpoint_file_path (str): Checkpoint file, or None to disable checkpoints.
+    - checkpoint_interval, report_interval (int): Frames between checkpoints and between
+      running estimates.
+    - distribution_lags (np.ndarray): Time intervals (frames) of the displacement
+      distributions, or None to skip them.
+    - van_hove_bins, van_hove_max_distance: Binning of the van Hove histograms. The range
+      cannot be adjusted once the histograms exist, so van_hove_max_distance is required
+      with distribution_lags.
+    
+    Returns:
+    - lags (np.ndarray): Time intervals in analysed frames.
+    - msd_all_frames (np.ndarray): MSD values for each atom at different time intervals.
+    - avg_msd (np.ndarray): Average MSD over all atoms at each time interval.
+    - propagated_error_per_time (np.ndarray): Error in MSD calculations.
+    - distributions (tuple): Time intervals, non-Gaussian parameter, van Hove
+      distributions and their bin edges, or None.
+    """
+    if distribution_lags is not None and van_hove_max_distance is None:
+        raise ValueError("The online van Hove histograms need van_hove_max_distance")
+    if distribution_lags is None:
+        van_hove_bins, van_hove_max_distance = 0, None
+
+    accumulator = None
+    initial_position = None
+    first_frame = start_frame
+    if checkpoint_file_path is not None and os.path.exists(checkpoint_file_path):
+        state = load_checkpoint(checkpoint_file_path)
+        if not np.array_equal(state['frame_selection'], [start_frame, frame_stride]):
+            raise ValueError(f"{checkpoint_file_path} was written for a different frame selection")
+        check_trajectory_identity(checkpoint_file_path, state, trajectory_file_path)
+        # The histograms cover every multi-tau interval, so only their binning has to match
+        saved_parameters = np.concatenate((state['parameters'][1:3], state['van_hove_parameters']))
+        parameters = [points_per_level, block_size, van_hove_bins, van_hove_max_distance or 0.0]
+        if not np.allclose(saved_parameters, parameters):
+            raise ValueError(f"{checkpoint_file_path} was written with different multi-tau or van Hove parameters")
+        accumulator = OnlineMSD.from_state(state)
+        # Reading restarts at the last analysed frame, whose unwrapped position is known
+        first_frame = start_frame + (accumulator.n_frames - 1) * frame_stride
+        initial_position = accumulator.last_position
+        print(f"Resuming from {checkpoint_file_path} after {accumulator.n_frames} frames")
+
+    def save_state():
+        if checkpoint_file_path is not None:
+            save_checkpoint(checkpoint_file_path, frame_selection=np.array([start_frame, frame_stride]),
+                            trajectory=trajectory_identity(trajectory_file_path), **accumulator.get_state())
+
+    frames = load_trajectory(trajectory_file_path, first_frame, stop_frame, frame_stride, default_box=default_box)
+    skip_first_frame = accumulator is not None
+    for chunk in iter_unwrapped_chunks(frames, initial_position=initial_position):
+        if skip_first_frame:
+            chunk = chunk[1:]
+            skip_first_frame = False
+        for position in chunk:
+            if accumulator is None:
+                accumulator = OnlineMSD(len(position), points_per_level, block_size,
+                                        van_hove_bins, van_hove_max_distance or 0.0)
+            accumulator.add_frame(position)
+
+            if accumulator.n_frames % report_interval == 0:
+                lags, msd_all_frames = accumulator.estimate()
+                avg_msd, error_per_time = summarize_msd(msd_all_frames)
+                save_msd(lags * frame_stride, avg_msd, error_per_time)
+                if len(lags):
+                    print(f"Frame {accumulator.n_frames}: msd {avg_msd[-1]:.3f} at time interval {lags[-1]}")
+            if accumulator.n_frames % checkpoint_interval == 0:
+                save_state()
+
+    if accumulator is None:
+        raise ValueError(f"No frames selected from {trajectory_file_path}")
+    save_state()
+    lags, msd_all_frames = accumulator.estimate()
 
-    return np.array(msd_all_frames).T, np.array(avg_msd_per_time), np.array(propagated_error_per_time)
+    distributions = None
+    if distribution_lags is not None and len(lags):
+        _, fourth_moment, van_hove, bin_edges = accumulator.estimate_distributions()
+        nearest = np.unique(np.abs(lags[:, np.newaxis] - np.asarray(distribution_lags)).argmin(axis=0))
+        distributions = (lags[nearest], non_gaussian_parameter(msd_all_frames, fourth_moment)[nearest],
+                         van_hove[nearest], bin_edges)
 
-def plot_msd(msd_all_frames, avg_msd, error_per_time):
+    return (lags, msd_all_frames) + summarize_msd(msd_all_frames) + (distributions,)
+
+def plot_msd(lags, msd_all_frames, avg_msd, error_per_time, frame_stride=1):
     """
     Plots MSD over time, including individual atom MSDs and the average MSD with error bars.
     
     Parameters:
+    - lags (np.ndarray): Time intervals in analysed frames.
     - msd_all_frames (np.ndarray): MSD values for each atom over time.
     - avg_msd (np.ndarray): Average MSD across all atoms.
     - error_per_time (np.ndarray): Propagated error in MSD values.
+    - frame_stride (int): Number of trajectory frames between consecutive analysed frames.
     """
-    time = np.arange(1, avg_msd.size + 1)
+    time = lags * frame_stride
 
     # Plot individual msds for each atom
     for atom_msd in msd_all_frames:
@@ -131,10 +530,7 @@ def plot_msd(msd_all_frames, avg_msd, error_per_time):
     plt.errorbar(time, avg_msd, yerr=error_per_time, color='blue', label='Average msd', linewidth=2, capsize=3)
 
     # Save average msd to file
-    output_file_path = 'msd_calvados_sc.txt'
-    with open(output_file_path, 'w') as output_file:
-        for i in range(len(time)):
-            output_file.write(f"{time[i]}\t{avg_msd[i]}\t{error_per_time[i]}\n")
+    save_msd(time, avg_msd, error_per_time)
 
     # Customize the plot appearance
     plt.xlabel("Time (frames)")
@@ -143,12 +539,49 @@ def plot_msd(msd_all_frames, avg_msd, error_per_time):
     plt.legend()
     plt.show()
 
-# File path to your PDB file
-pdb_file_path = 'traj_cm.pdb'
+# Main script
+if __name__ == "__main__":
+    # File path to your trajectory (PDB, LAMMPS dump or DCD)
+    trajectory_file_path = 'traj_cm.pdb'
+    start_frame = 0     # First frame to analyse (e.g. to discard equilibration)
+    stop_frame = None   # Frame to stop at (None for the end of the trajectory)
+    frame_stride = 1    # Analyse every n-th frame
+    default_box_length = 500.0  # Cubic box length for frames without box information in the file
+    lag_schedule = 'linear'     # 'linear' (every time interval), 'log' (log-spaced) or 'multi-tau'
+    n_lags = 100                # Number of time intervals of the 'log' schedule
+    error_method = 'atoms'      # 'atoms' (spread between proteins), 'blocks' (block averaging) or 'bootstrap'
+    confidence = 0.95           # Confidence level of the diffusion coefficient
+    fit_range = None            # (first, last) time interval in frames of the diffusion fit (None for all)
+    distribution_lags = None    # Time intervals (frames) of the non-Gaussian parameter and van Hove
+                                # distributions, e.g. [10, 100, 1000] (None to skip them)
+    van_hove_max_distance = 100.0  # Largest displacement (Å) in the van Hove histograms
+    online = False              # Stream the trajectory through multi-tau buffers instead of loading it
+    checkpoint_file_path = 'msd_checkpoint.npz'  # State of the online analysis, resumed if present
+
+    if online:
+        # Bounded memory for trajectories larger than RAM; running estimates are written as it goes
+        lags, msd_all_frames, avg_msd, error_per_time, distributions = calculate_msd_online(
+            trajectory_file_path, start_frame, stop_frame, frame_stride, default_box=default_box_length,
+            checkpoint_file_path=checkpoint_file_path, distribution_lags=distribution_lags,
+            van_hove_max_distance=van_hove_max_distance)
+        _, _, diffusion = calculate_msd_errors(lags, msd_all_frames, confidence=confidence, fit_range=fit_range)
+    else:
+        # Read the selected frames and their boxes (from the binary cache, or streamed for compressed
+        # trajectories) and calculate msd; the frames are unwrapped as they are read
+        frames = load_trajectory(trajectory_file_path, start_frame, stop_frame, frame_stride,
+                                 default_box=default_box_length)
+        lags, msd_all_frames, avg_msd, error_per_time, diffusion, distributions = calculate_msd_rolling_average(
+            frames, lag_schedule, n_lags, error_method=error_method, distribution_lags=distribution_lags,
+            van_hove_max_distance=van_hove_max_distance, confidence=confidence, fit_range=fit_range)
+
+    diffusion_coefficient, diffusion_low, diffusion_high = (value / frame_stride for value in diffusion)
+    print(f"Diffusion coefficient: {diffusion_coefficient:.6g} Å^2/frame "
+          f"({confidence:.0%} confidence interval {diffusion_low:.6g} to {diffusion_high:.6g})")
 
-# Parse PDB file and calculate msd
-frames = parse_pdb_frames(pdb_file_path)
-msd_all_frames, avg_msd, error_per_time = calculate_msd_rolling_average(frames)
+    # Save the non-Gaussian parameter and van Hove distributions
+    if distributions is not None:
+        distribution_lags, alpha2, van_hove, bin_edges = distributions
+        save_distributions(distribution_lags * frame_stride, alpha2, van_hove, bin_edges)
 
-# Plot msd results
-plot_msd(msd_all_frames, avg_msd, error_per_time)
+    # Plot msd results
+    plot_msd(lags, msd_all_frames, avg_msd, error_per_time, frame_stride)
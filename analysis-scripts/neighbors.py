@@ -0,0 +1,340 @@
+import itertools
+
+import numpy as np
+
+from pbc import box_to_cell, minimum_image
+
+def _cell_grid(coords, cutoff, box):
+    """
+    Assigns every bead to a cell of a grid whose cells are at least `cutoff` wide.
+
+    The grid is laid out in fractional coordinates of the box, so triclinic boxes are
+    handled like orthorhombic ones: the number of cells along each axis is set by the
+    perpendicular width of the box. Axes without periodicity (zero box length) span the
+    extent of the beads instead.
+
+    Returns:
+    - cell_indices (np.ndarray): Grid position of every bead (n_beads x 3).
+    - n_cells (np.ndarray): Number of cells along each axis.
+    - periodic (np.ndarray): Whether each axis is periodic.
+    """
+    box = np.zeros(6) if box is None else np.asarray(box, dtype=np.float64)
+    lengths, angles = box[:3], box[3:]
+    periodic = lengths > 0
+    # Axes without periodicity get a unit length so that the cell matrix can be inverted
+    cell = box_to_cell(np.concatenate((np.where(periodic, lengths, 1.0), np.where(angles > 0, angles, 90.0))))
+    fractional = coords @ np.linalg.inv(cell)
+    # Perpendicular width of the cell along each axis: volume / area of the opposite face
+    widths = abs(np.linalg.det(cell)) / np.linalg.norm(np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1)
+
+    cell_indices = np.empty(fractional.shape, dtype=np.int64)
+    n_cells = np.empty(3, dtype=np.int64)
+    for axis in range(3):
+        if periodic[axis]:
+            offsets = fractional[:, axis] % 1.0
+            span = 1.0
+            n_cells[axis] = int(widths[axis] // cutoff)
+            if n_cells[axis] < 3:
+                # Neighbouring cells would wrap onto each other, so the axis is not split
+                n_cells[axis] = 1
+        else:
+            offsets = fractional[:, axis] - fractional[:, axis].min()
+            span = max(offsets.max(), np.finfo(np.float64).tiny)
+            n_cells[axis] = max(1, int(span * widths[axis] // cutoff))
+        cell_indices[:, axis] = np.minimum((offsets * (n_cells[axis] / span)).astype(np.int64), n_cells[axis] - 1)
+    return cell_indices, n_cells, periodic
+
+def _expand_ranges(starts, counts):
+    """
+    Concatenates the integer ranges [start, start + count) into one array.
+    """
+    total = counts.sum()
+    range_offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(total) - range_offsets
+
+def find_neighbor_pairs(coords, cutoff, box=None, groups=None, group_pairs=None):
+    """
+    Finds all pairs of beads closer than `cutoff` with a cell list.
+
+    The beads are binned once into cells at least `cutoff` wide, so every neighbour of a
+    bead lies in its own cell or one of the 26 adjacent ones. Each cell is compared with
+    itself and with half of its neighbours, which visits every pair of adjacent cells
+    once. The number of candidate pairs, and the cost, grows linearly with the number of
+    beads at constant density, instead of quadratically.
+
+    Parameters:
+    - coords (np.ndarray): Bead positions (n_beads x 3).
+    - cutoff (float): Contact distance.
+    - box (np.ndarray): Cell lengths and angles (a, b, c, alpha, beta, gamma) for the
+      minimum image, or None (or zeros) without periodic boundaries.
+    - groups (np.ndarray): Group (e.g. protein) of every bead, numbered from 0. Pairs
+      within the same group are skipped before any distance is computed.
+    - group_pairs (np.ndarray): Pairs of groups (g, h) whose beads are compared; pairs of
+      beads of other groups are skipped too. None compares all groups.
+
+    Returns:
+    - pairs (np.ndarray): Indices (i, j) of the beads in contact, with i < j (n_pairs x 2).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    cell_indices, n_cells, periodic = _cell_grid(coords, cutoff, box)
+
+    # Beads sorted by cell, with the first bead and the bead count of every cell
+    flat_cells = np.ravel_multi_index(cell_indices.T, n_cells)
+    order = np.argsort(flat_cells, kind='stable')
+    sorted_cells = flat_cells[order]
+    cell_starts = np.searchsorted(sorted_cells, np.arange(np.prod(n_cells)))
+    cell_counts = np.diff(np.append(cell_starts, len(order)))
+    sorted_indices = cell_indices[order]
+
+    # Half of the neighbouring cells, so that each pair of cells is visited once
+    axis_offsets = [(-1, 0, 1) if n_cells[axis] > 1 else (0,) for axis in range(3)]
+    offsets = [offset for offset in itertools.product(*axis_offsets) if offset > (0, 0, 0)]
+
+    first, second = [], []
+    # Pairs within the same cell: each bead with the beads after it in the cell
+    positions = np.arange(len(order))
+    cell_ends = cell_starts[sorted_cells] + cell_counts[sorted_cells]
+    counts = cell_ends - positions - 1
+    first.append(np.repeat(positions, counts))
+    second.append(_expand_ranges(positions + 1, counts))
+
+    for offset in offsets:
+        neighbor_indices = sorted_indices + offset
+        valid = np.ones(len(order), dtype=bool)
+        for axis in range(3):
+            if periodic[axis]:
+                neighbor_indices[:, axis] %= n_cells[axis]
+            else:
+                valid &= (neighbor_indices[:, axis] >= 0) & (neighbor_indices[:, axis] < n_cells[axis])
+        neighbor_cells = np.ravel_multi_index(neighbor_indices[valid].T, n_cells)
+        counts = cell_counts[neighbor_cells]
+        first.append(np.repeat(positions[valid], counts))
+        second.append(_expand_ranges(cell_starts[neighbor_cells], counts))
+
+    # Positions in cell order, mapped back to bead indices once the pairs are filtered
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+    if groups is not None:
+        groups = np.asarray(groups)[order]
+        if group_pairs is None:
+            kept = groups[first] != groups[second]
+        else:
+            # Table of the allowed pairs of groups, in both orders; pairs within a group are never allowed
+            n_groups = groups.max() + 1
+            group_pairs = np.asarray(group_pairs, dtype=np.int64).reshape(-1, 2)
+            allowed = np.zeros(n_groups * n_groups, dtype=bool)
+            allowed[group_pairs[:, 0] * n_groups + group_pairs[:, 1]] = True
+            allowed[group_pairs[:, 1] * n_groups + group_pairs[:, 0]] = True
+            kept = allowed[groups[first] * n_groups + groups[second]]
+        first, second = first[kept], second[kept]
+    first, second = order[first], order[second]
+
+    differences = coords[second] - coords[first]
+    if np.any(periodic):
+        differences = minimum_image(differences, box)
+    close = np.einsum('ij,ij->i', differences, differences) < cutoff ** 2
+    pairs = np.stack((first[close], second[close]), axis=1)
+    pairs.sort(axis=1)
+    return pairs
+
+def protein_bounding_spheres(coords, num_atoms_per_protein, box=None):
+    """
+    Computes a bounding sphere for every protein, for all proteins at once.
+
+    The beads of each protein are first brought into the minimum image of its first bead,
+    so proteins split across a periodic boundary get a compact sphere.
+
+    Parameters:
+    - coords (np.ndarray): Bead positions of all proteins, protein after protein (N x 3).
+    - num_atoms_per_protein (int): Number of beads of every protein.
+    - box (np.ndarray): Cell lengths and angles for the minimum image, or None.
+
+    Returns:
+    - centres (np.ndarray): Centre of the beads of each protein (n_proteins x 3).
+    - radii (np.ndarray): Largest distance of a bead from its protein centre (n_proteins).
+    """
+    num_proteins = len(coords) // num_atoms_per_protein
+    proteins = np.asarray(coords[:num_proteins * num_atoms_per_protein], dtype=np.float64).reshape(
+        num_proteins, num_atoms_per_protein, 3)
+    relative = proteins - proteins[:, :1]
+    if box is not None:
+        relative = minimum_image(relative, box)
+    mean_relative = relative.mean(axis=1)
+    radii = np.sqrt(np.max(np.sum((relative - mean_relative[:, np.newaxis]) ** 2, axis=2), axis=1))
+    return proteins[:, 0] + mean_relative, radii
+
+def find_candidate_protein_pairs(centres, radii, cutoff, box=None):
+    """
+    Finds the pairs of proteins whose bounding spheres come within `cutoff` of each
+    other. Only these pairs can have beads in contact.
+
+    Parameters:
+    - centres (np.ndarray): Centre of each protein (n_proteins x 3).
+    - radii (np.ndarray): Bounding radius of each protein (n_proteins).
+    - cutoff (float): Contact distance.
+    - box (np.ndarray): Cell lengths and angles for the minimum image, or None.
+
+    Returns:
+    - protein_pairs (np.ndarray): Indices (p, q) of the candidate pairs, with p < q
+      (n_pairs x 2).
+    """
+    first, second = np.triu_indices(len(centres), k=1)
+    differences = centres[second] - centres[first]
+    if box is not None:
+        differences = minimum_image(differences, box)
+    reach = radii[first] + radii[second] + cutoff
+    close = np.einsum('ij,ij->i', differences, differences) < reach ** 2
+    return np.stack((first[close], second[close]), axis=1)
+
+def find_protein_bead_pairs(coords, num_atoms_per_protein, cutoff, box=None):
+    """
+    Finds all pairs of beads of different proteins closer than `cutoff`.
+
+    Proteins whose bounding sphere is not within reach of any other are dropped before
+    the cell list is built, which removes most beads in a dilute box, and the beads of
+    the remaining proteins are only compared between pairs of proteins whose spheres
+    are within reach of each other.
+
+    Parameters:
+    - coords (np.ndarray): Bead positions of all proteins, protein after protein (N x 3).
+    - num_atoms_per_protein (int): Number of beads of every protein.
+    - cutoff (float): Contact distance.
+    - box (np.ndarray): Cell lengths and angles for the minimum image, or None.
+
+    Returns:
+    - bead_pairs (np.ndarray): Indices (i, j) of the beads in contact, with i < j
+      (n_pairs x 2).
+    """
+    centres, radii = protein_bounding_spheres(coords, num_atoms_per_protein, box)
+    candidate_pairs = find_candidate_protein_pairs(centres, radii, cutoff, box)
+    candidates = np.unique(candidate_pairs)
+
+    # Beads of the candidate proteins only, grouped by the position of their protein among the candidates
+    bead_indices = (candidates[:, np.newaxis] * num_atoms_per_protein + np.arange(num_atoms_per_protein)).ravel()
+    proteins = np.repeat(np.arange(len(candidates)), num_atoms_per_protein)
+    bead_pairs = find_neighbor_pairs(coords[bead_indices], cutoff, box, groups=proteins,
+                                     group_pairs=np.searchsorted(candidates, candidate_pairs))
+    return bead_indices[bead_pairs].reshape(-1, 2)
+
+def find_protein_contact_pairs(coords, num_atoms_per_protein, cutoff, box=None):
+    """
+    Finds the pairs of proteins with at least one pair of beads closer than `cutoff`.
+
+    Parameters:
+    - coords (np.ndarray): Bead positions of all proteins, protein after protein (N x 3).
+    - num_atoms_per_protein (int): Number of beads of every protein.
+    - cutoff (float): Contact distance.
+    - box (np.ndarray): Cell lengths and angles for the minimum image, or None.
+
+    Returns:
+    - protein_pairs (np.ndarray): Unique indices (p, q) of the proteins in contact, with
+      p < q, sorted (n_pairs x 2).
+    """
+    bead_pairs = find_protein_bead_pairs(coords, num_atoms_per_protein, cutoff, box)
+    return np.unique(bead_pairs // num_atoms_per_protein, axis=0).reshape(-1, 2)
+
+def bead_to_protein_pairs(bead_pairs, num_atoms_per_protein, num_proteins):
+    """
+    Reduces pairs of beads of different proteins, with i < j, to the unique pairs of
+    proteins they belong to.
+
+    Returns:
+    - protein_pairs (np.ndarray): Unique indices (p, q) of the proteins, with p < q, sorted
+      (n_pairs x 2).
+    """
+    proteins = np.asarray(bead_pairs, dtype=np.int64).reshape(-1, 2) // num_atoms_per_protein
+    flat_pairs = np.unique(proteins[:, 0] * num_proteins + proteins[:, 1])
+    return np.stack(np.divmod(flat_pairs, num_proteins), axis=1)
+
+class VerletContactTracker:
+    """
+    Incremental protein contact finder for consecutive frames, based on a Verlet list.
+
+    The list holds every pair of beads of different proteins closer than cutoff + skin
+    when it is built. As long as no bead has moved more than skin / 2 since then, no pair
+    outside the list can have come within `cutoff`, so each frame only re-tests the pairs
+    of the list. The list is rebuilt with the cell list when a bead has moved further, or
+    when the box has changed (e.g. under a barostat), since the minimum image of the
+    listed pairs is then no longer guaranteed. For closely spaced frames a rebuild is
+    only needed every few frames, and the frames in between cost a displacement check and
+    one distance per listed pair.
+    """
+
+    def __init__(self, num_atoms_per_protein, cutoff, skin):
+        """
+        Parameters:
+        - num_atoms_per_protein (int): Number of beads of every protein.
+        - cutoff (float): Contact distance.
+        - skin (float): Extra distance of the Verlet list beyond the cutoff. A larger skin
+          means fewer rebuilds but more pairs to re-test every frame.
+        """
+        self.num_atoms_per_protein = num_atoms_per_protein
+        self.cutoff = cutoff
+        self.skin = skin
+        self.n_rebuilds = 0
+        self._reference_coords = None  # Bead positions when the list was built
+        self._reference_box = None
+        self._first = None              # Listed bead pairs
+        self._second = None
+
+    def _needs_rebuild(self, coords, box):
+        if self._reference_coords is None or len(coords) != len(self._reference_coords):
+            return True
+        if (box is None) != (self._reference_box is None):
+            return True
+        if box is not None and not np.array_equal(box, self._reference_box):
+            return True
+        displacements = coords - self._reference_coords
+        if box is not None:
+            displacements = minimum_image(displacements, box)
+        max_squared_displacement = np.max(np.einsum('ij,ij->i', displacements, displacements), initial=0.0)
+        return max_squared_displacement > (self.skin / 2) ** 2
+
+    def _rebuild(self, coords, box):
+        bead_pairs = find_protein_bead_pairs(coords, self.num_atoms_per_protein, self.cutoff + self.skin, box)
+        self._first, self._second = bead_pairs[:, 0], bead_pairs[:, 1]
+        self._reference_coords = coords
+        self._reference_box = None if box is None else box.copy()
+        self.n_rebuilds += 1
+
+    def find_bead_pairs(self, coords, box=None):
+        """
+        Finds the pairs of beads of different proteins closer than the cutoff in the next
+        frame.
+
+        Parameters:
+        - coords (np.ndarray): Bead positions of all proteins, protein after protein (N x 3).
+        - box (np.ndarray): Cell lengths and angles for the minimum image, or None.
+
+        Returns:
+        - bead_pairs (np.ndarray): Indices (i, j) of the beads in contact, with i < j
+          (n_pairs x 2).
+        """
+        # Copies, since frame readers reuse their buffer
+        coords = np.array(coords, dtype=np.float64)
+        if box is not None:
+            box = np.array(box, dtype=np.float64)
+            if not np.any(box[:3] > 0):
+                box = None
+        if self._needs_rebuild(coords, box):
+            self._rebuild(coords, box)
+
+        differences = coords[self._second] - coords[self._first]
+        if box is not None:
+            differences = minimum_image(differences, box)
+        close = np.einsum('ij,ij->i', differences, differences) < self.cutoff ** 2
+        return np.stack((self._first[close], self._second[close]), axis=1)
+
+    def find_protein_pairs(self, coords, box=None):
+        """
+        Finds the pairs of proteins in contact in the next frame, like
+        find_protein_contact_pairs.
+
+        Returns:
+        - protein_pairs (np.ndarray): Unique indices (p, q) of the proteins in contact, with
+          p < q, sorted (n_pairs x 2).
+        """
+        return bead_to_protein_pairs(self.find_bead_pairs(coords, box), self.num_atoms_per_protein,
+                                     len(coords) // self.num_atoms_per_protein)
@@ -0,0 +1,205 @@
+import numpy as np
+
+class OnlineMSD:
+    """
+    Streaming multi-tau accumulator of the MSD of every atom.
+
+    Frames are added one at a time and never stored, so memory is bounded by the
+    multi-tau buffers: every level keeps its last `points_per_level` positions and the
+    running sum of the block it is averaging. Level 0 holds the frames themselves and
+    covers intervals 1 to points_per_level-1. Every `block_size` positions of a level are
+    averaged into one position of the next level, which covers intervals
+    points_per_level/block_size to points_per_level-1 in units of its coarser time step.
+    The intervals are the same as those of msd.compute_msd_multi_tau on the whole
+    trajectory, with the same result.
+
+    For every atom and interval, the sums of the squared displacements and of their
+    squares are accumulated, along with the number of time origins, so the non-Gaussian
+    parameter comes at no extra cost. Optionally, a histogram of the displacement lengths
+    (self van Hove distribution) is accumulated for every interval as well.
+    """
+
+    def __init__(self, n_atoms, points_per_level=16, block_size=2, van_hove_bins=0, van_hove_max_distance=0.0):
+        """
+        Parameters:
+        - n_atoms (int): Number of atoms in every frame.
+        - points_per_level (int): Number of time intervals per level.
+        - block_size (int): Number of positions averaged from one level to the next.
+        - van_hove_bins (int): Number of bins of the van Hove histograms (0 to disable them).
+        - van_hove_max_distance (float): Upper edge of the van Hove histograms; longer
+          displacements are counted in the normalization only.
+        """
+        self.n_atoms = n_atoms
+        self.points_per_level = points_per_level
+        self.block_size = block_size
+        self.van_hove_bins = van_hove_bins
+        self.van_hove_max_distance = van_hove_max_distance
+        self.n_frames = 0
+        self.last_position = None  # Most recent unwrapped frame, to resume unwrapping
+
+        # Per-level state, one entry per level
+        self._buffers = []        # Last positions (points_per_level x N x 3), used as a ring
+        self._n_samples = []      # Number of positions added to the level
+        self._block_sums = []     # Sum of the positions of the block being averaged (N x 3)
+        self._block_counts = []   # Number of positions in that block
+        self._sums = []           # Sum of squared displacements per interval (points_per_level x N)
+        self._squared_sums = []   # Sum of squared squared displacements per interval
+        self._counts = []         # Number of time origins per interval (points_per_level)
+        self._histograms = []     # Displacement length counts per interval (points_per_level x van_hove_bins)
+
+    def _add_level(self):
+        self._buffers.append(np.zeros((self.points_per_level, self.n_atoms, 3)))
+        self._n_samples.append(0)
+        self._block_sums.append(np.zeros((self.n_atoms, 3)))
+        self._block_counts.append(0)
+        self._sums.append(np.zeros((self.points_per_level, self.n_atoms)))
+        self._squared_sums.append(np.zeros((self.points_per_level, self.n_atoms)))
+        self._counts.append(np.zeros(self.points_per_level, dtype=np.int64))
+        self._histograms.append(np.zeros((self.points_per_level, self.van_hove_bins), dtype=np.int64))
+
+    def _first_lag(self, level):
+        return 1 if level == 0 else self.points_per_level // self.block_size
+
+    def _add_sample(self, level, position):
+        if level == len(self._buffers):
+            self._add_level()
+        buffer = self._buffers[level]
+        n_samples = self._n_samples[level]
+
+        # Displacements from all buffered positions at once
+        lags = np.arange(self._first_lag(level), min(n_samples, self.points_per_level - 1) + 1)
+        if len(lags):
+            displacements = position - buffer[(n_samples - lags) % self.points_per_level]
+            squared_displacements = np.sum(displacements ** 2, axis=2)
+            self._sums[level][lags] += squared_displacements
+            self._squared_sums[level][lags] += squared_displacements ** 2
+            self._counts[level][lags] += 1
+            if self.van_hove_bins:
+                self._add_to_histograms(level, lags, squared_displacements)
+
+        buffer[n_samples % self.points_per_level] = position
+        self._n_samples[level] = n_samples + 1
+
+        # Completed blocks are passed on to the next level as their average
+        self._block_sums[level] += position
+        self._block_counts[level] += 1
+        if self._block_counts[level] == self.block_size:
+            block_average = self._block_sums[level] / self.block_size
+            self._block_sums[level][:] = 0
+            self._block_counts[level] = 0
+            self._add_sample(level + 1, block_average)
+
+    def _add_to_histograms(self, level, lags, squared_displacements):
+        # One bincount over (interval, bin) pairs updates the histograms of all intervals
+        bins = (np.sqrt(squared_displacements) * (self.van_hove_bins / self.van_hove_max_distance)).astype(np.int64)
+        in_range = bins < self.van_hove_bins
+        flat_bins = (lags[:, np.newaxis] * self.van_hove_bins + bins)[in_range]
+        self._histograms[level] += np.bincount(
+            flat_bins, minlength=self.points_per_level * self.van_hove_bins).reshape(self.points_per_level, -1)
+
+    def add_frame(self, position):
+        """
+        Adds the next frame of the trajectory.
+
+        Parameters:
+        - position (np.ndarray): Unwrapped atomic positions of the frame (N x 3).
+        """
+        position = np.array(position, dtype=np.float64)
+        self._add_sample(0, position)
+        self.last_position = position
+        self.n_frames += 1
+
+    def _moments(self):
+        """
+        Returns the intervals with at least one time origin, in frames, with their sums
+        (n_lags x N), origin counts (n_lags) and van Hove histograms (n_lags x van_hove_bins).
+        """
+        lags, sums, squared_sums, counts, histograms = [], [], [], [], []
+        for level in range(len(self._buffers)):
+            level_lags = np.arange(self._first_lag(level), self.points_per_level)
+            sampled = self._counts[level][level_lags] > 0
+            level_lags = level_lags[sampled]
+            lags.append(level_lags * self.block_size ** level)
+            sums.append(self._sums[level][level_lags])
+            squared_sums.append(self._squared_sums[level][level_lags])
+            counts.append(self._counts[level][level_lags])
+            histograms.append(self._histograms[level][level_lags])
+        if not lags:
+            return (np.zeros(0, dtype=np.int64), np.zeros((0, self.n_atoms)), np.zeros((0, self.n_atoms)),
+                    np.zeros(0, dtype=np.int64), np.zeros((0, self.van_hove_bins), dtype=np.int64))
+        return (np.concatenate(lags), np.concatenate(sums), np.concatenate(squared_sums),
+                np.concatenate(counts), np.concatenate(histograms))
+
+    def estimate(self):
+        """
+        Returns the current estimate of the MSD.
+
+        Returns:
+        - lags (np.ndarray): Time intervals in frames.
+        - msd (np.ndarray): MSD for each atom at each time interval (N x n_lags).
+        """
+        lags, sums, _, counts, _ = self._moments()
+        return lags, (sums / counts[:, np.newaxis]).T
+
+    def estimate_distributions(self):
+        """
+        Returns the current estimate of the displacement distributions.
+
+        Returns:
+        - lags (np.ndarray): Time intervals in frames.
+        - fourth_moment (np.ndarray): Mean fourth power of the displacement length for
+          each atom at each time interval (N x n_lags).
+        - van_hove (np.ndarray): Probability density of the displacement length at each
+          time interval (n_lags x van_hove_bins), or None without histograms.
+        - bin_edges (np.ndarray): Edges of the van Hove bins, or None without histograms.
+        """
+        lags, _, squared_sums, counts, histograms = self._moments()
+        fourth_moment = (squared_sums / counts[:, np.newaxis]).T
+        if not self.van_hove_bins:
+            return lags, fourth_moment, None, None
+        bin_edges = np.linspace(0, self.van_hove_max_distance, self.van_hove_bins + 1)
+        van_hove = histograms / (counts[:, np.newaxis] * self.n_atoms * np.diff(bin_edges))
+        return lags, fourth_moment, van_hove, bin_edges
+
+    def get_state(self):
+        """
+        Returns the full state of the accumulator as named arrays, for save_checkpoint.
+        """
+        return {
+            'parameters': np.array([self.n_atoms, self.points_per_level, self.block_size, self.n_frames]),
+            'van_hove_parameters': np.array([self.van_hove_bins, self.van_hove_max_distance]),
+            'last_position': (self.last_position if self.last_position is not None
+                              else np.zeros((0, 3))),
+            'buffers': np.array(self._buffers).reshape(-1, self.points_per_level, self.n_atoms, 3),
+            'n_samples': np.array(self._n_samples, dtype=np.int64),
+            'block_sums': np.array(self._block_sums).reshape(-1, self.n_atoms, 3),
+            'block_counts': np.array(self._block_counts, dtype=np.int64),
+            'sums': np.array(self._sums).reshape(-1, self.points_per_level, self.n_atoms),
+            'squared_sums': np.array(self._squared_sums).reshape(-1, self.points_per_level, self.n_atoms),
+            'counts': np.array(self._counts, dtype=np.int64).reshape(-1, self.points_per_level),
+            # Explicit shape: the histograms are empty without van Hove bins
+            'histograms': np.array(self._histograms, dtype=np.int64).reshape(len(self._histograms),
+                                                                            self.points_per_level,
+                                                                            self.van_hove_bins),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuilds an accumulator from the arrays returned by get_state.
+        """
+        n_atoms, points_per_level, block_size, n_frames = (int(value) for value in state['parameters'])
+        van_hove_bins, van_hove_max_distance = state['van_hove_parameters']
+        accumulator = cls(n_atoms, points_per_level, block_size, int(van_hove_bins), float(van_hove_max_distance))
+        accumulator.n_frames = n_frames
+        if len(state['last_position']):
+            accumulator.last_position = state['last_position'].copy()
+        accumulator._buffers = list(state['buffers'].copy())
+        accumulator._n_samples = [int(value) for value in state['n_samples']]
+        accumulator._block_sums = list(state['block_sums'].copy())
+        accumulator._block_counts = [int(value) for value in state['block_counts']]
+        accumulator._sums = list(state['sums'].copy())
+        accumulator._squared_sums = list(state['squared_sums'].copy())
+        accumulator._counts = list(state['counts'].copy())
+        accumulator._histograms = list(state['histograms'].copy())
+        return accumulator
@@ -0,0 +1,134 @@
+import collections
+import itertools
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+FRAME_CHUNK_SIZE = 64  # Consecutive frames handed to a worker at a time
+
+def _shared_chunk_views(buffer, n_frames, n_atoms, coords_dtype):
+    """
+    Returns the positions (n_frames x N x 3) and boxes (n_frames x 6) stored one after
+    the other in a shared memory buffer.
+    """
+    coords = np.ndarray((n_frames, n_atoms, 3), dtype=coords_dtype, buffer=buffer)
+    boxes = np.ndarray((n_frames, 6), dtype=np.float64, buffer=buffer, offset=coords.nbytes)
+    return coords, boxes
+
+def _chunk_size_bytes(chunk_size, n_atoms, coords_dtype):
+    return chunk_size * (n_atoms * 3 * np.dtype(coords_dtype).itemsize + 6 * np.dtype(np.float64).itemsize)
+
+def _run_shared_chunk(chunk_function, shared_memory_name, chunk_size, n_frames, n_atoms, coords_dtype, args):
+    """
+    Worker for map_frame_chunks: attaches to the shared memory block of a chunk of frames
+    and applies the chunk function to it, without copying the frames.
+    """
+    block = shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        coords, boxes = _shared_chunk_views(block.buf, chunk_size, n_atoms, coords_dtype)
+        result = chunk_function(coords[:n_frames], boxes[:n_frames], *args)
+        # The views must be released before the block can be closed
+        del coords, boxes
+        return result
+    finally:
+        block.close()
+
+def _read_chunk(frames, coords, boxes):
+    """
+    Copies the next frames of a trajectory into the chunk buffers, until they are full or
+    the trajectory ends. Frames without a box get zeros.
+
+    Returns:
+    - n_frames (int): Number of frames read (0 at the end of the trajectory).
+    """
+    n_frames = 0
+    for frame_coords, box in itertools.islice(frames, len(coords)):
+        coords[n_frames] = frame_coords
+        boxes[n_frames] = 0 if box is None else box
+        n_frames += 1
+    return n_frames
+
+def _collect(pending):
+    """
+    Waits for the oldest chunk in flight and frees its shared memory block.
+    """
+    future, block = pending[0]
+    try:
+        return future.result()
+    finally:
+        pending.popleft()
+        block.close()
+        block.unlink()
+
+def map_frame_chunks(chunk_function, frames, args=(), n_workers=None, chunk_size=FRAME_CHUNK_SIZE):
+    """
+    Applies a function to consecutive chunks of frames in a process pool, and yields its
+    results in trajectory order.
+
+    The frames are read in this process, which is the only one touching the trajectory
+    file, straight into a shared memory block per chunk that the workers map without
+    copying or pickling the coordinates. A worker gets consecutive frames, so state
+    carried from one frame to the next (e.g. a Verlet list) is reused within a chunk.
+    At most two chunks per worker are in flight, which bounds the memory used for any
+    trajectory length while keeping the workers busy.
+
+    Parameters:
+    - chunk_function (callable): Module-level function called as
+      chunk_function(coords, boxes, *args), with the positions (n_frames x N x 3) and
+      boxes (n_frames x 6) of a chunk. Its result must not be a view of its inputs.
+    - frames (iterable): Pairs of atomic positions (N x 3) and box, as returned by
+      load_trajectory.
+    - args (tuple): Further arguments of chunk_function.
+    - n_workers (int): Number of processes (None for all cores, 1 to run in-process).
+    - chunk_size (int): Number of frames per chunk.
+
+    Yields:
+    - result: Result of chunk_function for each chunk, in the order of the chunks.
+    """
+    frames = iter(frames)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        return
+    n_atoms = len(first_frame[0])
+    coords_dtype = np.asarray(first_frame[0]).dtype
+    frames = itertools.chain([first_frame], frames)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    if n_workers <= 1:
+        coords = np.empty((chunk_size, n_atoms, 3), dtype=coords_dtype)
+        boxes = np.empty((chunk_size, 6))
+        while n_frames := _read_chunk(frames, coords, boxes):
+            yield chunk_function(coords[:n_frames], boxes[:n_frames], *args)
+        return
+
+    pending = collections.deque()  # (future, shared memory block) of the chunks in flight, in order
+    with ProcessPoolExecutor(n_workers) as executor:
+        try:
+            while True:
+                block = shared_memory.SharedMemory(create=True, size=_chunk_size_bytes(chunk_size, n_atoms,
+                                                                                        coords_dtype))
+                coords, boxes = _shared_chunk_views(block.buf, chunk_size, n_atoms, coords_dtype)
+                n_frames = _read_chunk(frames, coords, boxes)
+                del coords, boxes
+                if not n_frames:
+                    block.close()
+                    block.unlink()
+                    break
+                pending.append((executor.submit(_run_shared_chunk, chunk_function, block.name, chunk_size,
+                                                n_frames, n_atoms, coords_dtype, args), block))
+                while len(pending) >= 2 * n_workers:
+                    yield _collect(pending)
+            while pending:
+                yield _collect(pending)
+        finally:
+            for future, block in pending:
+                future.cancel()
+            for future, block in pending:
+                if not future.cancelled():
+                    future.exception()  # Waits for the worker to release the block
+                block.close()
+                block.unlink()
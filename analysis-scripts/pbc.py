@@ -0,0 +1,159 @@
+import itertools
+
+import numpy as np
+
+UNWRAP_CHUNK_SIZE = 1024  # Frames unwrapped at a time
+
+def box_to_cell(box):
+    """
+    Builds the cell vectors of a box given by its lengths and angles.
+
+    The first vector lies along x and the second in the xy plane, as in the PDB and
+    LAMMPS conventions.
+
+    Parameters:
+    - box (np.ndarray): Cell lengths and angles in degrees (a, b, c, alpha, beta, gamma),
+      or an array of boxes (... x 6).
+
+    Returns:
+    - cell (np.ndarray): Cell vectors as rows (... x 3 x 3).
+    """
+    box = np.asarray(box, dtype=np.float64)
+    a, b, c = np.moveaxis(box[..., :3], -1, 0)
+    cos_alpha, cos_beta, cos_gamma = np.cos(np.radians(np.moveaxis(box[..., 3:], -1, 0)))
+    sin_gamma = np.sin(np.radians(box[..., 5]))
+
+    cell = np.zeros(box.shape[:-1] + (3, 3))
+    cell[..., 0, 0] = a
+    cell[..., 1, 0] = b * cos_gamma
+    cell[..., 1, 1] = b * sin_gamma
+    cell[..., 2, 0] = c * cos_beta
+    cell[..., 2, 1] = c * (cos_alpha - cos_beta * cos_gamma) / sin_gamma
+    cell[..., 2, 2] = np.sqrt(np.maximum(c ** 2 - cell[..., 2, 0] ** 2 - cell[..., 2, 1] ** 2, 0))
+    return cell
+
+def minimum_image(vectors, box):
+    """
+    Brings displacement vectors into the minimum image of a periodic box.
+
+    Orthorhombic boxes are handled with one rounding per component. Triclinic boxes are
+    reduced in fractional coordinates through the inverse cell matrix, after which the
+    neighbouring images are checked too, since rounding alone can miss the nearest image
+    in strongly skewed cells. A box length of zero (e.g. a box read from a file without
+    box information) disables the periodicity along that axis.
+
+    Parameters:
+    - vectors (np.ndarray): Displacement vectors (... x 3).
+    - box (np.ndarray): Cell lengths and angles (a, b, c, alpha, beta, gamma), or one box
+      per entry of the first axis of `vectors` (n x 6), e.g. one per frame.
+
+    Returns:
+    - vectors (np.ndarray): Minimum-image displacement vectors, with the shape of `vectors`.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    box = np.asarray(box, dtype=np.float64)
+    # Per-frame boxes are broadcast over the remaining axes of the vectors
+    box = box.reshape(box.shape[:-1] + (1,) * (vectors.ndim - box.ndim) + (6,))
+    lengths = box[..., :3]
+    angles = box[..., 3:]
+    periodic = lengths > 0
+
+    if np.all((angles == 90) | (angles == 0)):
+        periodic_lengths = np.where(periodic, lengths, np.inf)
+        return vectors - lengths * np.round(vectors / periodic_lengths)
+
+    # Empty boxes get a unit cell so that the matrix can be inverted; they are not shifted
+    cell = box_to_cell(np.concatenate((np.where(periodic, lengths, 1.0),
+                                       np.where(angles > 0, angles, 90.0)), axis=-1))
+    fractional = vectors[..., np.newaxis, :] @ np.linalg.inv(cell)
+    fractional -= np.round(fractional) * periodic[..., np.newaxis, :]
+    vectors = (fractional @ cell)[..., 0, :]
+
+    nearest = vectors
+    nearest_squared = np.sum(vectors ** 2, axis=-1)
+    for shift in itertools.product((-1.0, 0.0, 1.0), repeat=3):
+        translation = ((shift * periodic)[..., np.newaxis, :] @ cell)[..., 0, :]
+        candidate = vectors + translation
+        candidate_squared = np.sum(candidate ** 2, axis=-1)
+        closer = candidate_squared < nearest_squared
+        nearest = np.where(closer[..., np.newaxis], candidate, nearest)
+        nearest_squared = np.where(closer, candidate_squared, nearest_squared)
+    return nearest
+
+def _iter_frame_chunks(frames, chunk_size):
+    """
+    Groups (coords, box) frames into arrays of at most `chunk_size` frames.
+
+    Frames from a generator may reuse one buffer for every frame, so they are copied into
+    chunk buffers that are reused in turn.
+    """
+    coords_chunk = None
+    box_chunk = np.empty((chunk_size, 6))
+    n_filled = 0
+    for coords, box in frames:
+        if coords_chunk is None:
+            coords_chunk = np.empty((chunk_size,) + np.shape(coords))
+        coords_chunk[n_filled] = coords
+        box_chunk[n_filled] = box
+        n_filled += 1
+        if n_filled == chunk_size:
+            yield coords_chunk, box_chunk
+            n_filled = 0
+    if n_filled:
+        yield coords_chunk[:n_filled], box_chunk[:n_filled]
+
+def iter_unwrapped_chunks(frames, chunk_size=UNWRAP_CHUNK_SIZE, initial_position=None):
+    """
+    Unwraps a trajectory chunk by chunk, removing the jumps across periodic boundaries.
+
+    The displacement between consecutive frames is brought into the minimum image of the
+    box of the later frame and accumulated with a cumulative sum, vectorized over all
+    atoms and all frames of a chunk. Only the last frame of the previous chunk is carried
+    over, so the trajectory can be streamed. Unlike a minimum-image correction between two
+    distant frames, this stays correct when an atom travels more than half a box between
+    them, as long as it moves less than half a box between consecutive frames. Since every
+    frame uses its own box, this also holds when the box fluctuates (NPT runs).
+
+    Parameters:
+    - frames (iterable): Pairs of wrapped atomic positions (N x 3) and box (a, b, c,
+      alpha, beta, gamma), such as the frames returned by trajectory.load_trajectory.
+    - chunk_size (int): Number of frames unwrapped at a time.
+    - initial_position (np.ndarray): Unwrapped position of the first frame (N x 3), to
+      continue an unwrapping that was interrupted. By default the first frame is kept
+      as it is.
+
+    Yields:
+    - unwrapped (np.ndarray): Continuous atomic positions of the next chunk of frames
+      (n_chunk_frames x N x 3, float64), starting from the first frame.
+    """
+    previous_wrapped = None
+    previous_unwrapped = None
+
+    for chunk, boxes in _iter_frame_chunks(frames, chunk_size):
+        if previous_wrapped is None:
+            # The first frame has zero displacement from itself
+            previous_wrapped = chunk[0]
+            previous_unwrapped = chunk[0] if initial_position is None else initial_position
+
+        steps = np.diff(chunk, axis=0, prepend=previous_wrapped[np.newaxis])
+        steps = minimum_image(steps, boxes)
+        unwrapped = np.cumsum(steps, axis=0, out=steps)
+        unwrapped += previous_unwrapped
+
+        previous_wrapped = chunk[-1].copy()
+        previous_unwrapped = unwrapped[-1].copy()
+        yield unwrapped
+
+def unwrap_trajectory(frames, chunk_size=UNWRAP_CHUNK_SIZE):
+    """
+    Unwraps a whole trajectory into a single array (see iter_unwrapped_chunks).
+
+    Parameters:
+    - frames (iterable): Pairs of wrapped atomic positions (N x 3) and box (a, b, c,
+      alpha, beta, gamma).
+    - chunk_size (int): Number of frames unwrapped at a time.
+
+    Returns:
+    - unwrapped (np.ndarray): Continuous atomic positions (n_frames x N x 3, float64).
+    """
+    return np.concatenate(list(iter_unwrapped_chunks(frames, chunk_size)))
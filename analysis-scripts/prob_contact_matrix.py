@@ -1,68 +1,253 @@
+import os
+
 import numpy as np
 import matplotlib.pyplot as plt
 
-def parse_pdb_frames(file_path):
-    """
-    Parse a PDB file containing multiple frames separated by 'END' lines.
-    Returns a list of NumPy arrays, each containing atomic coordinates for a frame.
-    """
-    frames = []
-    current_coords = []
-    
-    with open(file_path, 'r') as file:
-        for line_num, line in enumerate(file, 1):
-            if line.startswith("ATOM"):
-                parts = line.split()
-                try:
-                    x, y, z = float(parts[6]), float(parts[7]), float(parts[8])
-                    current_coords.append([x, y, z])
-            elif line.startswith("END"):
-                if current_coords:
-                    frames.append(np.array(current_coords))
-                    current_coords = []
-    
-    if current_coords:
-        frames.append(np.array(current_coords))
-    
-    return frames
-
-def compute_distances(coords1, coords2):
-    """
-    Compute pairwise Euclidean distances between two sets of atomic coordinates.
-    """
-    diff = coords1[:, np.newaxis, :] - coords2[np.newaxis, :, :]
-    distances = np.sqrt(np.sum(diff**2, axis=2))
-    return distances
-
-def update_contact_matrix(coords, num_atoms_per_protein, cutoff):
+from checkpoint import check_trajectory_identity, load_checkpoint, save_checkpoint, trajectory_identity
+from neighbors import find_protein_bead_pairs
+from parallel import map_frame_chunks
+from trajectory import load_trajectory, read_pdb_residue_names
+
+# Amino acids in the order of the force-field matrices (desired_order in input-scripts)
+RESIDUE_TYPES = ['TRP', 'TYR', 'PHE', 'MET', 'LEU', 'ILE', 'VAL', 'ALA', 'PRO', 'GLY',
+                 'CYS', 'GLN', 'ASN', 'THR', 'SER', 'GLU', 'ASP', 'LYS', 'HIS', 'ARG']
+
+def residue_type_indices(residue_names):
+    """
+    Map residue names to their index in RESIDUE_TYPES, with -1 for any other residue.
+    """
+    type_lookup = {residue: index for index, residue in enumerate(RESIDUE_TYPES)}
+    return np.array([type_lookup.get(residue, -1) for residue in residue_names], dtype=np.int64)
+
+def update_contact_matrix(coords, num_atoms_per_protein, cutoff, box=None, out=None, weighted=True,
+                          bead_types=None, type_out=None, bead_pairs=None, buffer=None):
     """
     Update the contact matrix based on distances less than the cutoff.
+    The bead pairs of different proteins within the cutoff are found once with the cell
+    list of neighbors.py, so every unordered pair of proteins is handled once, as protein
+    i against protein j > i. The reverse order (j against i) is the transpose, added once
+    all frames are accumulated with symmetrize_contact_matrix. With `out` and `buffer`,
+    no matrix is allocated per frame.
+
+    Parameters:
+    - coords (np.ndarray): Bead positions of all proteins, protein after protein (N x 3).
+    - num_atoms_per_protein (int): Number of beads of every protein.
+    - cutoff (float): Contact distance.
+    - box (np.ndarray): Cell lengths and angles for the minimum image, or None.
+    - out (np.ndarray): Matrix to add the contacts of this frame to, instead of a new one
+      (num_atoms_per_protein x num_atoms_per_protein, float64, C-contiguous).
+    - weighted (bool): Whether to use the weighted contribution, or to count the contacts
+      of every pair of beads directly.
+    - bead_types (np.ndarray): Residue type of every bead, as returned by
+      residue_type_indices (N). With `type_out`, the bead pairs in contact are also
+      counted by residue type, in one order like the contact matrix.
+    - type_out (np.ndarray): Residue-type contact counts to add the contacts of this frame
+      to (len(RESIDUE_TYPES) x len(RESIDUE_TYPES), float64, C-contiguous).
+    - bead_pairs (np.ndarray): Bead pairs of different proteins in contact, with i < j,
+      when they are already known (e.g. from a VerletContactTracker), instead of searching
+      them in `coords`.
+    - buffer (np.ndarray): Scratch matrix for the weighted contribution, reused from frame
+      to frame (num_atoms_per_protein x num_atoms_per_protein, float64).
+
+    Returns:
+    - matrix (np.ndarray): The contact matrix, `out` when given, still to be symmetrized.
+    """
+    if out is None:
+        out = np.zeros((num_atoms_per_protein, num_atoms_per_protein))
+    # The counts are added through flat views, which only exist for contiguous matrices
+    for matrix in (out, type_out):
+        if matrix is not None and not matrix.flags.c_contiguous:
+            raise ValueError("The contact matrices to update must be C-contiguous")
+
+    # Bead pairs (a, b) in contact with a < b, so protein i of a comes before protein j of b
+    if bead_pairs is None:
+        bead_pairs = find_protein_bead_pairs(coords, num_atoms_per_protein, cutoff, box)
+    proteins, beads = np.divmod(bead_pairs, num_atoms_per_protein)
+
+    if bead_types is not None and type_out is not None:
+        # The same bead pairs, counted by the residue types of their two beads
+        pair_types = bead_types[bead_pairs]
+        pair_types = pair_types[np.all(pair_types >= 0, axis=1)]
+        np.add.at(type_out.reshape(-1), pair_types[:, 0] * len(type_out) + pair_types[:, 1], 1.0)
+
+    if weighted:
+        # Update the matrix using a weighted contribution:
+        # This approach sums the number of contacts for each atom in i and each atom in j,
+        # then multiplies these sums to get a combined interaction score.
+        # The sums of all interacting pairs (i, j) are the rows of two matrices, so the sum
+        # of the products over the pairs is a single matrix product.
+        num_proteins = len(coords) // num_atoms_per_protein
+        _, pair_indices = np.unique(proteins[:, 0] * num_proteins + proteins[:, 1], return_inverse=True)
+        num_pairs = pair_indices.max(initial=-1) + 1
+        sums_shape = (num_pairs, num_atoms_per_protein)
+        row_sums = np.bincount(pair_indices * num_atoms_per_protein + beads[:, 0],
+                               minlength=np.prod(sums_shape)).reshape(sums_shape).astype(np.float64)
+        column_sums = np.bincount(pair_indices * num_atoms_per_protein + beads[:, 1],
+                                  minlength=np.prod(sums_shape)).reshape(sums_shape).astype(np.float64)
+        if buffer is None:
+            buffer = np.empty_like(out)
+        out += np.matmul(row_sums.T, column_sums, out=buffer)
+    else:
+        # Alternative approach:
+        # Instead of weighting contacts, update the matrix directly where contacts exist.
+        # This simply adds 1 to matrix[i, j] whenever atom i and atom j are in contact.
+        np.add.at(out.reshape(-1), beads[:, 0] * num_atoms_per_protein + beads[:, 1], 1.0)
+    return out
+
+def symmetrize_contact_matrix(matrix):
+    """
+    Adds the reverse order of every pair of proteins, j against i, to a contact matrix
+    (or residue-type counts) accumulated by update_contact_matrix, which holds i against j.
+    """
+    return matrix + matrix.T
+
+def accumulate_chunk_contact_matrix(coords, boxes, num_atoms_per_protein, cutoff, weighted=True, bead_types=None):
+    """
+    Sum the contact matrices, and the residue-type contact counts when the residue type of
+    every bead is given, of a chunk of frames (n_frames x N x 3, with boxes n_frames x 6).
+    This is the unit of work of the frame-parallel main loop.
+    """
+    matrix = np.zeros((num_atoms_per_protein, num_atoms_per_protein))
+    type_matrix = np.zeros((len(RESIDUE_TYPES), len(RESIDUE_TYPES)))
+    buffer = np.empty_like(matrix)
+    for frame_coords, box in zip(coords, boxes):
+        update_contact_matrix(frame_coords, num_atoms_per_protein, cutoff, box, out=matrix, weighted=weighted,
+                              bead_types=bead_types, type_out=type_matrix, buffer=buffer)
+    return symmetrize_contact_matrix(matrix), symmetrize_contact_matrix(type_matrix), len(coords)
+
+def contact_state(matrix, type_matrix, num_frames, parameters, reader_position=None, trajectory=None):
+    """
+    Collect the accumulated contacts as named arrays, for save_checkpoint and
+    merge_contact_states. The parameters are the number of beads per protein, the cutoff
+    and the weighting scheme. The reader position (start frame, stride and next frame to
+    read) and the identity of the trajectory (see checkpoint.trajectory_identity) are only
+    stored for a run that can be resumed.
+    """
+    state = {'contact_matrix': matrix, 'type_matrix': type_matrix, 'num_frames': np.array(num_frames),
+             'parameters': np.asarray(parameters, dtype=np.float64)}
+    if reader_position is not None:
+        state['reader_position'] = np.array(reader_position)
+        state['trajectory'] = trajectory
+    return state
+
+def completed_checkpoint_path(checkpoint_file_path):
+    """
+    Returns the path a checkpoint is renamed to once its run is complete, e.g.
+    contact_matrix_checkpoint_final.npz, so that a later run does not resume from it.
+    """
+    root, extension = os.path.splitext(checkpoint_file_path)
+    return f"{root}_final{extension}"
+
+def accumulate_contact_matrix(trajectory_file_path, num_atoms_per_protein, cutoff, start_frame=0, stop_frame=None,
+                              frame_stride=1, weighted=True, bead_types=None, n_workers=None,
+                              checkpoint_file_path=None, checkpoint_interval=1000, default_box=None):
     """
-    num_proteins = len(coords) // num_atoms_per_protein
+    Accumulate the contact matrix and residue-type contact counts over the selected frames
+    of a trajectory, with periodic checkpoints.
+
+    Chunks of frames are analysed in parallel and added in trajectory order, so the
+    accumulators always cover a contiguous run of frames. Every `checkpoint_interval`
+    frames they are saved atomically to `checkpoint_file_path` with the number of frames,
+    the position of the reader and the identity of the trajectory file; if that file
+    exists, the analysis resumes from it, provided the trajectory has not changed since.
+    Once all frames are done, the checkpoint is renamed (see completed_checkpoint_path),
+    so rerunning the analysis starts over. The final files, and checkpoints of interrupted
+    runs, can be merged with merge_contact_checkpoints.
+
+    Parameters:
+    - trajectory_file_path (str): Path to the trajectory.
+    - num_atoms_per_protein (int): Number of beads of every protein.
+    - cutoff (float): Contact distance.
+    - start_frame, stop_frame, frame_stride (int): Frame selection, as for load_trajectory.
+      start_frame must not be negative when resuming.
+    - weighted (bool): Weighted contact scores, or direct counts (see update_contact_matrix).
+    - bead_types (np.ndarray): Residue type of every bead, or None to skip residue types.
+    - n_workers (int): Number of processes (None for all cores, 1 to run in-process).
+    - checkpoint_file_path (str): Checkpoint file, or None to disable checkpoints. The
+      final results are saved to completed_checkpoint_path(checkpoint_file_path).
+    - checkpoint_interval (int): Frames between checkpoints.
+    - default_box (float or np.ndarray): Box for frames without box information.
+
+    Returns:
+    - state (dict): Accumulated 'contact_matrix' and 'type_matrix', and 'num_frames'.
+    """
+    parameters = [num_atoms_per_protein, cutoff, weighted]
     matrix = np.zeros((num_atoms_per_protein, num_atoms_per_protein))
+    type_matrix = np.zeros((len(RESIDUE_TYPES), len(RESIDUE_TYPES)))
+    num_frames = 0
+    if checkpoint_file_path is not None and os.path.exists(checkpoint_file_path):
+        state = load_checkpoint(checkpoint_file_path)
+        if not np.allclose(state['parameters'], parameters):
+            raise ValueError(f"{checkpoint_file_path} was written with different contact parameters")
+        if 'reader_position' not in state or not np.array_equal(state['reader_position'][:2],
+                                                                 [start_frame, frame_stride]):
+            raise ValueError(f"{checkpoint_file_path} was written for a different frame selection")
+        check_trajectory_identity(checkpoint_file_path, state, trajectory_file_path)
+        matrix, type_matrix, num_frames = state['contact_matrix'], state['type_matrix'], int(state['num_frames'])
+        print(f"Resuming from {checkpoint_file_path} after {num_frames} frames")
+
+    def save_state():
+        if checkpoint_file_path is not None:
+            reader_position = [start_frame, frame_stride, start_frame + num_frames * frame_stride]
+            save_checkpoint(checkpoint_file_path,
+                            **contact_state(matrix, type_matrix, num_frames, parameters, reader_position,
+                                            trajectory_identity(trajectory_file_path)))
+
+    # Reading restarts at the first frame not yet accumulated
+    frames = load_trajectory(trajectory_file_path, start_frame + num_frames * frame_stride, stop_frame, frame_stride,
+                             default_box=default_box)
+    last_checkpoint = num_frames
+    for chunk_matrix, chunk_type_matrix, chunk_frames in map_frame_chunks(
+            accumulate_chunk_contact_matrix, frames, (num_atoms_per_protein, cutoff, weighted, bead_types), n_workers):
+        matrix += chunk_matrix
+        type_matrix += chunk_type_matrix
+        num_frames += chunk_frames
+        if num_frames - last_checkpoint >= checkpoint_interval:
+            save_state()
+            last_checkpoint = num_frames
+    if checkpoint_file_path is not None:
+        save_state()
+        os.replace(checkpoint_file_path, completed_checkpoint_path(checkpoint_file_path))
+    return contact_state(matrix, type_matrix, num_frames, parameters)
+
+def merge_contact_states(states):
+    """
+    Merge the accumulated contacts of separate segments or replicas, as returned by
+    accumulate_contact_matrix or stored in its checkpoints. The sums over frames and the
+    frame counts add up, so every frame keeps the same weight in the merged averages.
+
+    Parameters:
+    - states (iterable): Accumulated contacts to merge (dicts of arrays).
+
+    Returns:
+    - state (dict): Merged 'contact_matrix', 'type_matrix' and 'num_frames', which can be
+      saved with save_checkpoint and merged again, but not resumed.
+    """
+    merged = None
+    for state in states:
+        if merged is None:
+            merged = contact_state(state['contact_matrix'], state['type_matrix'], int(state['num_frames']),
+                                    state['parameters'])
+            continue
+        if not np.allclose(state['parameters'], merged['parameters']):
+            raise ValueError("Cannot merge contacts accumulated with different contact parameters")
+        merged['contact_matrix'] = merged['contact_matrix'] + state['contact_matrix']
+        merged['type_matrix'] = merged['type_matrix'] + state['type_matrix']
+        merged['num_frames'] = merged['num_frames'] + state['num_frames']
+    if merged is None:
+        raise ValueError("No accumulated contacts to merge")
+    return merged
+
+def merge_contact_checkpoints(checkpoint_file_paths):
+    """
+    Merge the checkpoints of separate segments or replicas written by
+    accumulate_contact_matrix, as merge_contact_states does.
 
-    for i in range(num_proteins):
-        for j in range(num_proteins):
-            if i != j:
-                start_i, end_i = i * num_atoms_per_protein, (i + 1) * num_atoms_per_protein
-                start_j, end_j = j * num_atoms_per_protein, (j + 1) * num_atoms_per_protein
-                coords_i = coords[start_i:end_i]
-                coords_j = coords[start_j:end_j]
-                distances = compute_distances(coords_i, coords_j)
-                contacts = distances < cutoff
-                
-                # Update the matrix using a weighted contribution:
-                # This approach sums the number of contacts for each atom in i and each atom in j,
-                # then multiplies these sums to get a combined interaction score.
-                matrix += contacts.sum(axis=1).reshape(-1, 1) * contacts.sum(axis=0).reshape(1, -1)
-
-                # Alternative approach:
-                # Instead of weighting contacts, update the matrix directly where contacts exist.
-                # This simply adds 1 to matrix[i, j] whenever atom i and atom j are in contact.
-                
-                #matrix += contacts
-
-    return matrix
+    Parameters:
+    - checkpoint_file_paths (list): Checkpoint files to merge.
+    """
+    return merge_contact_states(load_checkpoint(checkpoint_file_path)
+                                for checkpoint_file_path in checkpoint_file_paths)
 
 def normalize_matrix(matrix):
     """
@@ -75,6 +260,27 @@ def normalize_matrix(matrix):
         return matrix
 
 
+def residue_type_propensity(type_matrix, bead_types):
+    """
+    Compare the residue-type contact probabilities with those expected from the
+    composition alone: 1 means residues of types a and b are in contact as often as
+    random pairing of the beads would give, above 1 more often.
+    """
+    composition = np.bincount(bead_types[bead_types >= 0], minlength=len(RESIDUE_TYPES)).astype(np.float64)
+    composition /= composition.sum()
+    expected = np.outer(composition, composition)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(expected > 0, normalize_matrix(type_matrix) / expected, 0.0)
+
+def save_residue_type_matrix(matrix, output_file_path):
+    """
+    Save a residue-type matrix as text, with the residue names as header and first column.
+    """
+    with open(output_file_path, 'w') as output_file:
+        output_file.write("\t" + "\t".join(RESIDUE_TYPES) + "\n")
+        for residue, row in zip(RESIDUE_TYPES, matrix):
+            output_file.write(residue + "\t" + "\t".join(str(value) for value in row) + "\n")
+
 def plot_contact_matrix(matrix, title):
     """
     Plot the contact matrix as a heatmap.
@@ -89,24 +295,37 @@ def plot_contact_matrix(matrix, title):
 
 # Main script
 if __name__ == "__main__":
-    pdb_file_path = 'traj_20.pdb'       # Path to the PDB file containing multiple frames
+    trajectory_file_path = 'traj_20.pdb'  # Trajectory with multiple frames (PDB, LAMMPS dump or DCD)
     num_atoms_per_protein = 229           # Number of atoms per protein in each frame
     cutoff_distance = 8.2                 # Distance threshold in angstroms
+    start_frame = 0                       # First frame to analyse (e.g. to discard equilibration)
+    stop_frame = None                     # Frame to stop at (None for the end of the trajectory)
+    frame_stride = 1                      # Analyse every n-th frame
+    default_box_length = 500.0            # Cubic box length for frames without box information in the file
+    n_workers = None                      # Processes analysing frames in parallel (None for all cores, 1 for none)
+    weighted_contacts = True              # Weighted contact scores, or direct counts of bead pairs in contact
+    residue_file_path = trajectory_file_path  # PDB with the residue names of the beads (None to skip residue types)
+    checkpoint_file_path = 'contact_matrix_checkpoint.npz'  # Resumed from if present (None to disable checkpoints)
+    checkpoint_interval = 1000            # Frames between checkpoints
+    merge_file_paths = []                 # Checkpoints (e.g. *_final.npz) of segments or replicas to merge instead
 
-    # Parse all frames from the PDB file
-    frames = parse_pdb_frames(pdb_file_path)
-    num_frames = len(frames)
-    print(f"Total number of frames found: {num_frames}\n")
-
-    # Initialize a matrix to accumulate contact matrices
-    accumulated_matrix = np.zeros((num_atoms_per_protein, num_atoms_per_protein))
+    # Residue type of every bead, for the contact statistics by pair of amino acids
+    bead_types = None
+    if residue_file_path is not None:
+        bead_types = residue_type_indices(read_pdb_residue_names(residue_file_path))
 
-    for frame_index, coords in enumerate(frames, 1):
-        # Update the contact matrix for the current frame
-        contact_matrix = update_contact_matrix(coords, num_atoms_per_protein, cutoff_distance)
+    if merge_file_paths:
+        # Combine the results of separate segments or replicas
+        state = merge_contact_checkpoints(merge_file_paths)
+    else:
+        # Accumulate the contact matrices of chunks of frames in parallel, checkpointing as it goes
+        state = accumulate_contact_matrix(trajectory_file_path, num_atoms_per_protein, cutoff_distance, start_frame,
+                                          stop_frame, frame_stride, weighted_contacts, bead_types, n_workers,
+                                          checkpoint_file_path, checkpoint_interval, default_box_length)
+    accumulated_matrix, accumulated_type_matrix = state['contact_matrix'], state['type_matrix']
+    num_frames = int(state['num_frames'])
 
-        # Accumulate the contact matrices
-        accumulated_matrix += contact_matrix
+    print(f"Total number of frames found: {num_frames}\n")
 
     # Compute the average contact matrix
     average_matrix = accumulated_matrix / num_frames
@@ -114,6 +333,12 @@ if __name__ == "__main__":
     # Normalize the averaged contact matrix to get probabilities
     average_prob_matrix = normalize_matrix(average_matrix)
 
+    # Save the residue-type contact statistics, in the order of the force-field matrices
+    if bead_types is not None:
+        save_residue_type_matrix(accumulated_type_matrix / num_frames, 'residue_type_contacts.txt')
+        save_residue_type_matrix(residue_type_propensity(accumulated_type_matrix, bead_types),
+                                 'residue_type_propensity.txt')
+
     # Plot the averaged contact probability matrix
     plot_contact_matrix(average_prob_matrix, 'Averaged Contact Probability Matrix')
 
@@ -0,0 +1,179 @@
+import glob
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from neighbors import VerletContactTracker, bead_to_protein_pairs
+from prob_contact_matrix import (RESIDUE_TYPES, contact_state, merge_contact_states, normalize_matrix,
+                                 plot_contact_matrix, residue_type_indices, residue_type_propensity,
+                                 save_residue_type_matrix, symmetrize_contact_matrix, update_contact_matrix)
+from trajectory import load_trajectory, read_pdb_residue_names
+
+def expand_trajectory_paths(trajectory_file_paths):
+    """
+    Expands a glob pattern, or a list of paths and patterns, into the list of replica
+    trajectories. The matches of every pattern are sorted, so replicas keep a stable order.
+    """
+    if isinstance(trajectory_file_paths, str):
+        trajectory_file_paths = [trajectory_file_paths]
+    expanded = []
+    for pattern in trajectory_file_paths:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise ValueError(f"No trajectory matches {pattern}")
+        expanded.extend(matches)
+    return expanded
+
+def analyse_replica(trajectory_file_path, num_atoms_per_protein, cutoff, skin, start_frame=0, stop_frame=None,
+                    frame_stride=1, weighted=True, bead_types=None, default_box=None):
+    """
+    Accumulates the contact matrix and counts the protein contacts of every frame of one
+    replica, in a single pass over its frames.
+
+    The bead pairs in contact are found once per frame with a Verlet list and used for both
+    the contact matrix and the number of protein pairs in contact.
+
+    Parameters:
+    - trajectory_file_path (str): Path to the trajectory of the replica.
+    - num_atoms_per_protein (int): Number of beads of every protein.
+    - cutoff (float): Contact distance.
+    - skin (float): Verlet skin distance.
+    - start_frame, stop_frame, frame_stride (int): Frame selection, as for load_trajectory.
+    - weighted (bool): Weighted contact scores, or direct counts (see update_contact_matrix).
+    - bead_types (np.ndarray): Residue type of every bead, or None to skip residue types.
+    - default_box (float or np.ndarray): Box for frames without box information.
+
+    Returns:
+    - state (dict): Accumulated contacts of the replica, as for merge_contact_states.
+    - frame_numbers (np.ndarray): Number of every analysed frame in the trajectory.
+    - contacts_over_time (np.ndarray): Number of protein pairs in contact in every frame.
+    """
+    # Replicas already run in parallel, so the cache of each one is built in its own process
+    frames = load_trajectory(trajectory_file_path, start_frame, stop_frame, frame_stride, n_workers=1,
+                             default_box=default_box)
+    contact_tracker = VerletContactTracker(num_atoms_per_protein, cutoff, skin)
+    matrix = np.zeros((num_atoms_per_protein, num_atoms_per_protein))
+    type_matrix = np.zeros((len(RESIDUE_TYPES), len(RESIDUE_TYPES)))
+    buffer = np.empty_like(matrix)
+    contacts_over_time = []
+    for coords, box in frames:
+        bead_pairs = contact_tracker.find_bead_pairs(coords, box)
+        update_contact_matrix(coords, num_atoms_per_protein, cutoff, box, out=matrix, weighted=weighted,
+                              bead_types=bead_types, type_out=type_matrix, bead_pairs=bead_pairs, buffer=buffer)
+        num_proteins = len(coords) // num_atoms_per_protein
+        contacts_over_time.append(len(bead_to_protein_pairs(bead_pairs, num_atoms_per_protein, num_proteins)))
+
+    num_frames = len(contacts_over_time)
+    matrix, type_matrix = symmetrize_contact_matrix(matrix), symmetrize_contact_matrix(type_matrix)
+    state = contact_state(matrix, type_matrix, num_frames, [num_atoms_per_protein, cutoff, weighted])
+    frame_numbers = start_frame + np.arange(num_frames) * frame_stride + 1
+    return state, frame_numbers, np.array(contacts_over_time, dtype=np.int64)
+
+def analyse_replicas(trajectory_file_paths, num_atoms_per_protein, cutoff, skin, start_frame=0, stop_frame=None,
+                     frame_stride=1, weighted=True, bead_types=None, default_box=None, n_workers=None):
+    """
+    Analyses independent replicas in a process pool, one replica per task, and merges
+    their contact matrices.
+
+    Every replica returns its sums over frames and its number of frames, so the merged
+    average gives every frame the same weight, whatever the length of each replica.
+
+    Parameters:
+    - trajectory_file_paths (list): Trajectories of the replicas.
+    - n_workers (int): Number of processes (None for all cores, 1 to run in-process).
+    - Other parameters: as for analyse_replica, the same for every replica.
+
+    Returns:
+    - state (dict): Merged accumulated contacts of all replicas.
+    - replica_results (list): Frame numbers and contacts over time of every replica.
+    """
+    args = (num_atoms_per_protein, cutoff, skin, start_frame, stop_frame, frame_stride, weighted, bead_types,
+            default_box)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(trajectory_file_paths))
+    if n_workers <= 1:
+        results = [analyse_replica(trajectory_file_path, *args) for trajectory_file_path in trajectory_file_paths]
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            results = list(executor.map(analyse_replica, trajectory_file_paths,
+                                        *([arg] * len(trajectory_file_paths) for arg in args)))
+
+    states, frame_numbers, contacts_over_time = zip(*results)
+    return merge_contact_states(states), list(zip(frame_numbers, contacts_over_time))
+
+def save_replica_contacts(trajectory_file_paths, replica_results, output_file_path):
+    """
+    Saves the number of contacts over time of every replica to one text file, with one
+    row per replica and frame.
+    """
+    with open(output_file_path, 'w') as output_file:
+        output_file.write("Replica\tFrame\tContacts\n")  # Header
+        for trajectory_file_path, (frame_numbers, contacts_over_time) in zip(trajectory_file_paths, replica_results):
+            for frame_number, contacts_count in zip(frame_numbers, contacts_over_time):
+                output_file.write(f"{trajectory_file_path}\t{frame_number}\t{contacts_count}\n")
+
+def save_contact_matrix(matrix, output_file_path):
+    """
+    Saves a contact matrix as tab-separated text, one row per bead.
+    """
+    with open(output_file_path, 'w') as output_file:
+        for row in matrix:
+            output_file.write("\t".join(str(value) for value in row) + "\n")
+
+# Main script
+if __name__ == "__main__":
+    trajectory_file_paths = 'replica_*/traj_20.pdb'  # Glob pattern, or list of paths/patterns, of the replicas
+    num_atoms_per_protein = 229           # Number of atoms per protein in each frame
+    cutoff_distance = 8.2                 # Distance threshold in angstroms
+    skin_distance = 2.0                   # Verlet skin in Å
+    start_frame = 0                       # First frame to analyse in every replica (e.g. to discard equilibration)
+    stop_frame = None                     # Frame to stop at (None for the end of each trajectory)
+    frame_stride = 1                      # Analyse every n-th frame
+    default_box_length = 500.0            # Cubic box length for frames without box information in the files
+    n_workers = None                      # Replicas analysed in parallel (None for all cores, 1 for none)
+    weighted_contacts = True              # Weighted contact scores, or direct counts of bead pairs in contact
+    residue_file_path = None              # PDB with the residue names of the beads (None to skip residue types)
+
+    replica_file_paths = expand_trajectory_paths(trajectory_file_paths)
+    print(f"Analysing {len(replica_file_paths)} replicas")
+
+    bead_types = None
+    if residue_file_path is not None:
+        bead_types = residue_type_indices(read_pdb_residue_names(residue_file_path))
+
+    # Map: every replica in its own process; reduce: sums over frames and frame counts
+    state, replica_results = analyse_replicas(replica_file_paths, num_atoms_per_protein, cutoff_distance,
+                                              skin_distance, start_frame, stop_frame, frame_stride,
+                                              weighted_contacts, bead_types, default_box_length, n_workers)
+    num_frames = int(state['num_frames'])
+    for replica_file_path, (_, contacts_over_time) in zip(replica_file_paths, replica_results):
+        print(f"{replica_file_path}: {len(contacts_over_time)} frames, "
+              f"{np.mean(contacts_over_time) if len(contacts_over_time) else 0:.2f} contacts on average")
+    print(f"Total number of frames found: {num_frames}\n")
+
+    # Combined contact probability matrix, with every frame of every replica weighted equally
+    average_prob_matrix = normalize_matrix(state['contact_matrix'] / num_frames)
+    save_contact_matrix(average_prob_matrix, 'contact_probability_matrix_replicas.txt')
+    save_replica_contacts(replica_file_paths, replica_results, 'contacts_over_time_replicas.txt')
+    if bead_types is not None:
+        save_residue_type_matrix(state['type_matrix'] / num_frames, 'residue_type_contacts_replicas.txt')
+        save_residue_type_matrix(residue_type_propensity(state['type_matrix'], bead_types),
+                                 'residue_type_propensity_replicas.txt')
+
+    # Plot the contacts over time of every replica
+    plt.figure(figsize=(10, 6))
+    for replica_file_path, (frame_numbers, contacts_over_time) in zip(replica_file_paths, replica_results):
+        plt.plot(frame_numbers, contacts_over_time, label=replica_file_path)
+    plt.xlabel("Frame")
+    plt.ylabel("Number of Contacts")
+    plt.title("Protein Contacts Over Time")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
+
+    # Plot the combined contact probability matrix
+    plot_contact_matrix(average_prob_matrix, 'Averaged Contact Probability Matrix (all replicas)')
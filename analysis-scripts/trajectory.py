@@ -0,0 +1,992 @@
+import bz2
+import gzip
+import io
+import itertools
+import lzma
+import os
+import queue
+import struct
+import sys
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from checkpoint import make_temp_file
+
+# Binary coordinate cache: a fixed-size header, a float32 array of shape (n_frames, N, 3) with the
+# coordinates and a float64 array of shape (n_frames, 6) with the box of every frame
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'TRAJBIN3'  # Changed whenever the content of the cache changes, so older caches are rebuilt
+CACHE_HEADER_FORMAT = '<8sqq6d'  # magic, n_frames, n_atoms, box of the first frame (a, b, c, alpha, beta, gamma)
+CACHE_HEADER_SIZE = 128  # Header is padded so the coordinate block starts on an aligned offset
+PARSE_CHUNK_SIZE = 1 << 26  # Upper bound on the bytes decoded by one task of the parallel conversion
+
+# Fixed columns of the x, y, z fields of an ATOM record (columns 31-54, three %8.3f fields)
+ATOM_COLUMNS = np.arange(30, 54)
+DIGIT_WEIGHTS = np.array([1000, 100, 10, 1, 0, 0.1, 0.01, 0.001])  # Place value of each character of an %8.3f field
+
+# Compressed trajectories are recognised from their magic bytes and decompressed in a background thread
+COMPRESSION_MAGIC = [(b'\x1f\x8b', gzip), (b'BZh', bz2), (b'\xfd7zXZ', lzma)]
+DECOMPRESS_BLOCK_SIZE = 1 << 22  # Bytes of decompressed data handed over at a time
+DECOMPRESS_QUEUE_SIZE = 8  # Decompressed blocks buffered ahead of the reader
+
+# Position columns of a LAMMPS dump, in order of preference: wrapped, unwrapped, scaled
+LAMMPS_POSITION_COLUMNS = [('x', 'y', 'z'), ('xu', 'yu', 'zu'), ('xs', 'ys', 'zs'), ('xsu', 'ysu', 'zsu')]
+
+# Sidecar index with the byte range of every frame of a PDB trajectory
+INDEX_SUFFIX = '.idx'
+INDEX_BLOCK_SIZE = 1 << 24  # Bytes read at a time while scanning for 'END' records
+
+def detect_compression(file_path):
+    """
+    Identifies gzip, bzip2 and xz compressed files from their magic bytes.
+
+    Returns:
+    - module (module): The matching decompression module (gzip, bz2 or lzma), or None
+      for uncompressed files.
+    """
+    with open(file_path, 'rb') as file:
+        head = file.read(6)
+    for magic, module in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return module
+    return None
+
+class _BackgroundDecompressor(io.RawIOBase):
+    """
+    Read-only stream over a compressed file whose decompression runs in a background
+    thread, so it overlaps with the decoding and analysis of the frames already read.
+    Decompressed blocks are handed over through a bounded queue and never touch the disk.
+    """
+
+    def __init__(self, compressed_file):
+        super().__init__()
+        self._blocks = queue.Queue(maxsize=DECOMPRESS_QUEUE_SIZE)
+        self._stopped = threading.Event()
+        self._pending = memoryview(b'')
+        self._at_eof = False
+        self._thread = threading.Thread(target=self._decompress, args=(compressed_file,), daemon=True)
+        self._thread.start()
+
+    def _decompress(self, compressed_file):
+        try:
+            with compressed_file:
+                while not self._stopped.is_set():
+                    block = compressed_file.read(DECOMPRESS_BLOCK_SIZE)
+                    self._put(block)
+                    if not block:
+                        return
+        except Exception as error:  # Re-raised in the reading thread
+            self._put(error)
+
+    def _put(self, item):
+        # Waits for room in the queue, but gives up once the reader has closed the stream
+        while not self._stopped.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            if self._at_eof:
+                return 0
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self._at_eof = True
+                return 0
+            self._pending = memoryview(block)
+
+        n_bytes = min(len(buffer), len(self._pending))
+        buffer[:n_bytes] = self._pending[:n_bytes]
+        self._pending = self._pending[n_bytes:]
+        return n_bytes
+
+    def close(self):
+        self._stopped.set()
+        super().close()
+
+def open_trajectory_file(file_path):
+    """
+    Opens a trajectory file for binary reading, decompressing gzip, bzip2 and xz files
+    on the fly in a background thread.
+
+    Parameters:
+    - file_path (str): Path to the (possibly compressed) trajectory file.
+
+    Returns:
+    - file (file object): Binary stream of the uncompressed contents.
+    """
+    compression = detect_compression(file_path)
+    if compression is None:
+        return open(file_path, 'rb')
+    return io.BufferedReader(_BackgroundDecompressor(compression.open(file_path, 'rb')),
+                             buffer_size=DECOMPRESS_BLOCK_SIZE)
+
+def _check_sequential_selection(start, stop):
+    """
+    Rejects frame selections counted from the end, which need the frame count of a
+    file that is read sequentially.
+    """
+    if start < 0 or (stop is not None and stop < 0):
+        raise ValueError("This trajectory is read sequentially; use non-negative start and stop")
+
+def _find_record(buffer, record_name, start, end):
+    """
+    Returns the offset of the first line in buffer[start:end] that starts with
+    `record_name`, or -1 if there is none. `start` must be the start of a line.
+    """
+    if start < end and buffer.startswith(record_name, start):
+        return start
+    found = buffer.find(b'\n' + record_name, start, end)
+    return found + 1 if found >= 0 else -1
+
+def _iter_raw_pdb_frames(file):
+    """
+    Splits an open PDB trajectory into frames while reading it in large binary blocks.
+
+    'END' records are found with plain byte searches, without decoding any coordinates.
+    Segments that contain no ATOM records (e.g. an 'END' following 'ENDMDL') are not
+    counted as frames.
+
+    Yields:
+    - frame (tuple): Byte offset of the frame in the stream and its raw text (a
+      memoryview into the read buffer, without the closing 'END' record).
+    """
+    block_offset = 0  # Stream offset of the first byte of `buffer`
+    buffer = b''
+
+    while True:
+        block = file.read(INDEX_BLOCK_SIZE)
+        buffer += block
+        # Only complete lines are scanned; the remainder is kept for the next block
+        scan_end = len(buffer) if not block else buffer.rfind(b'\n') + 1
+        frame_start = 0
+        while True:
+            record_start = _find_record(buffer, b'END', frame_start, scan_end)
+            if record_start < 0:
+                break
+            record_end = buffer.find(b'\n', record_start, scan_end) + 1 or scan_end
+            if _find_record(buffer, b'ATOM', frame_start, record_start) >= 0:
+                yield block_offset + frame_start, memoryview(buffer)[frame_start:record_start]
+            frame_start = record_end
+
+        if not block:
+            # In case there is no 'END' at the end of the file
+            if _find_record(buffer, b'ATOM', frame_start, len(buffer)) >= 0:
+                yield block_offset + frame_start, memoryview(buffer)[frame_start:]
+            return
+        block_offset += frame_start
+        buffer = buffer[frame_start:]
+
+def build_frame_index(file_path):
+    """
+    Scans a PDB trajectory once and records the byte range of every frame.
+
+    Parameters:
+    - file_path (str): Path to the PDB file.
+
+    Returns:
+    - index (np.ndarray): Start and end byte offset of each frame (n_frames x 2, int64).
+    """
+    with open(file_path, 'rb') as file:
+        frame_ranges = [(offset, offset + len(raw_frame)) for offset, raw_frame in _iter_raw_pdb_frames(file)]
+    return np.array(frame_ranges, dtype=np.int64).reshape(-1, 2)
+
+def load_frame_index(file_path):
+    """
+    Returns the frame index of a PDB trajectory, cached next to it.
+
+    The index is stored as `<file>` + INDEX_SUFFIX and rebuilt whenever the PDB file
+    is newer than it. If it cannot be stored (e.g. in a read-only directory), the index
+    is rebuilt on every call.
+
+    Parameters:
+    - file_path (str): Path to the PDB file.
+
+    Returns:
+    - index (np.ndarray): Start and end byte offset of each frame (n_frames x 2, int64).
+    """
+    index_file_path = file_path + INDEX_SUFFIX
+    if (os.path.exists(index_file_path)
+            and os.path.getmtime(index_file_path) >= os.path.getmtime(file_path)):
+        with open(index_file_path, 'rb') as index_file:
+            return np.load(index_file)
+
+    index = build_frame_index(file_path)
+    try:
+        tmp_file_path = make_temp_file(index_file_path)
+        try:
+            with open(tmp_file_path, 'wb') as index_file:
+                np.save(index_file, index)
+            os.replace(tmp_file_path, index_file_path)
+        except BaseException:
+            os.remove(tmp_file_path)
+            raise
+    except OSError as error:
+        print(f"Could not store the frame index {index_file_path} ({error}), keeping it in memory only")
+    return index
+
+def decode_pdb_frame(raw_frame, out=None):
+    """
+    Extracts the atomic positions from the raw bytes of one PDB frame.
+
+    The whole frame is decoded with array operations: ATOM records are located from
+    the newline positions, and x, y, z are cut from the fixed PDB columns (31-54) and
+    converted from their digits directly. Reading fixed columns keeps negative values
+    and coordinates that fill their whole field (e.g. "-123.456100.000") correct.
+    Fields that are not written as %8.3f fall back to a generic string conversion.
+
+    Parameters:
+    - raw_frame (bytes or memoryview): Text of the frame as stored in the file.
+    - out (np.ndarray): Optional preallocated array (N x 3) to write the positions into.
+
+    Returns:
+    - coords (np.ndarray): Atomic positions of the frame (N x 3).
+    """
+    data = np.frombuffer(raw_frame, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord('\n'))
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_ends = np.concatenate((newlines, [len(data)]))
+
+    # Select the lines whose first four characters are 'ATOM'
+    long_enough = line_ends - line_starts >= 4
+    line_starts, line_ends = line_starts[long_enough], line_ends[long_enough]
+    is_atom = np.ones(len(line_starts), dtype=bool)
+    for offset, char in enumerate(b'ATOM'):
+        is_atom &= data[line_starts + offset] == char
+    atom_starts = line_starts[is_atom]
+    n_atoms = len(atom_starts)
+    if np.any(line_ends[is_atom] - atom_starts < ATOM_COLUMNS[-1] + 1):
+        raise ValueError("Frame contains an ATOM record without complete coordinates")
+    if out is None:
+        out = np.empty((n_atoms, 3))
+    elif n_atoms != len(out):
+        raise ValueError(f"Frame has {n_atoms} atoms instead of {len(out)}")
+    if n_atoms == 0:
+        return out
+
+    # Equally long records (the usual case) are read through a strided view without a gather
+    line_steps = np.diff(atom_starts)
+    if n_atoms > 1 and np.all(line_steps == line_steps[0]):
+        fields = np.lib.stride_tricks.as_strided(data[atom_starts[0] + ATOM_COLUMNS[0]:],
+                                                 shape=(n_atoms, len(ATOM_COLUMNS)),
+                                                 strides=(line_steps[0], 1))
+    else:
+        fields = data[atom_starts[:, np.newaxis] + ATOM_COLUMNS]
+    fields = fields.reshape(-1, 8)  # One row per coordinate field
+
+    digits = fields - np.uint8(ord('0'))  # Non-digit characters wrap around to values >= 10
+    is_digit = digits < 10
+    is_sign = fields == ord('-')
+    if (np.all(fields[:, 4] == ord('.'))
+            and np.all(is_digit | is_sign | (fields == ord(' ')) | (fields == ord('.')))):
+        values = (digits * is_digit).astype(np.float64) @ DIGIT_WEIGHTS
+        negative = is_sign.view(np.uint64).ravel() != 0  # Any '-' in the 8-byte field
+        values[negative] = -values[negative]
+    else:
+        values = np.ascontiguousarray(fields).view('S8').ravel().astype(np.float64)
+
+    out[:] = values.reshape(n_atoms, 3)
+    return out
+
+def _parse_cryst1(line):
+    """
+    Returns the cell lengths and angles (a, b, c, alpha, beta, gamma) of a CRYST1 record.
+    The 1 Å unit cube that the PDB format prescribes for structures without a cell (e.g.
+    NMR models) is returned as zeros, like a missing record.
+    """
+    box = np.array([float(line[6:15]), float(line[15:24]), float(line[24:33]),
+                    float(line[33:40]), float(line[40:47]), float(line[47:54])])
+    if np.all(box[:3] == 1.0):
+        return np.zeros(6)
+    return box
+
+def decode_pdb_box(raw_frame):
+    """
+    Reads the unit cell from the CRYST1 record of one PDB frame.
+
+    Parameters:
+    - raw_frame (bytes or memoryview): Text of the frame as stored in the file.
+
+    Returns:
+    - box (np.ndarray): Cell lengths and angles (a, b, c, alpha, beta, gamma), or None
+      if the frame has no CRYST1 record.
+    """
+    raw_frame = bytes(raw_frame)
+    record_start = _find_record(raw_frame, b'CRYST1', 0, len(raw_frame))
+    if record_start < 0:
+        return None
+    return _parse_cryst1(raw_frame[record_start:record_start + 54])
+
+def iter_pdb_frames(file_path, start=0, stop=None, stride=1):
+    """
+    Lazily reads a PDB trajectory file with frames separated by 'END' lines.
+
+    The frame index is used to seek straight to the selected frames, so skipped frames
+    are never read or converted. Compressed files are decompressed on the fly instead.
+    The first frame fixes the number of atoms; every following frame is written into the
+    same preallocated array, which keeps memory constant regardless of the trajectory
+    length. Frames without their own CRYST1 record keep the last box read.
+
+    Parameters:
+    - file_path (str): Path to the PDB file.
+    - start, stop, stride (int): Frame selection, with the same meaning as a slice.
+
+    Yields:
+    - coords (np.ndarray): Atomic positions of the current frame (N x 3). The array is
+      reused for the next frame, so copy it if it has to be kept.
+    - box (np.ndarray): Cell lengths and angles of the current frame (a, b, c, alpha,
+      beta, gamma), or zeros if the file has no CRYST1 records.
+    """
+    coords = None
+    box = read_pdb_box(file_path)
+
+    if detect_compression(file_path) is not None:
+        # Compressed streams cannot seek, so frames are split off while decompressing
+        _check_sequential_selection(start, stop)
+        with open_trajectory_file(file_path) as file:
+            raw_frames = itertools.islice(_iter_raw_pdb_frames(file), start, stop, stride)
+            for _, raw_frame in raw_frames:
+                coords = decode_pdb_frame(raw_frame, coords)
+                frame_box = decode_pdb_box(raw_frame)
+                if frame_box is not None:
+                    box = frame_box
+                yield coords, box
+        return
+
+    index = load_frame_index(file_path)
+    with open(file_path, 'rb') as file:
+        for frame_start, frame_end in index[start:stop:stride]:
+            file.seek(frame_start)
+            raw_frame = file.read(frame_end - frame_start)
+            coords = decode_pdb_frame(raw_frame, coords)
+            frame_box = decode_pdb_box(raw_frame)
+            if frame_box is not None:
+                box = frame_box
+            yield coords, box
+
+def read_pdb_frames(file_path, start=0, stop=None, stride=1):
+    """
+    Reads the selected frames of a PDB trajectory into a single array.
+
+    Parameters:
+    - file_path (str): Path to the PDB file.
+    - start, stop, stride (int): Frame selection, with the same meaning as a slice.
+
+    Returns:
+    - frames (np.ndarray): Atomic positions for every frame (n_frames x N x 3).
+    """
+    frames = [coords.copy() for coords, _ in iter_pdb_frames(file_path, start, stop, stride)]
+    if not frames:
+        raise ValueError(f"No frames found in {file_path}")
+    return np.stack(frames)
+
+def read_pdb_box(file_path):
+    """
+    Reads the unit cell from the first CRYST1 record of a PDB file.
+
+    Parameters:
+    - file_path (str): Path to the PDB file.
+
+    Returns:
+    - box (np.ndarray): Cell lengths and angles (a, b, c, alpha, beta, gamma), or zeros
+      if the file has no CRYST1 record before its first atom.
+    """
+    with open_trajectory_file(file_path) as file:
+        for line in file:
+            if line.startswith(b"CRYST1"):
+                return _parse_cryst1(line)
+            if line.startswith(b"ATOM"):
+                break
+    return np.zeros(6)
+
+def read_pdb_residue_names(file_path):
+    """
+    Reads the residue name of every atom of the first frame of a PDB file.
+
+    Parameters:
+    - file_path (str): Path to the PDB file (a trajectory or a single structure).
+
+    Returns:
+    - residue_names (np.ndarray): Residue name (columns 18-20) of every ATOM record, in
+      the order of the atoms (N, str).
+    """
+    residue_names = []
+    with open_trajectory_file(file_path) as file:
+        for line in file:
+            if line.startswith(b"ATOM"):
+                residue_names.append(line[17:20].strip().decode())
+            elif line.startswith(b"END") and residue_names:
+                break
+    if not residue_names:
+        raise ValueError(f"No ATOM records found in {file_path}")
+    return np.array(residue_names)
+
+def _read_lammps_dump_header(file):
+    """
+    Reads the 'ITEM:' header of the next frame of a LAMMPS text dump.
+
+    Returns:
+    - header (tuple): Number of atoms, box bounds (3 x 2, or 3 x 3 with the xy, xz, yz
+      tilt factors for triclinic boxes) and the names of the atom columns, or None at
+      the end of the file.
+    """
+    line = file.readline()
+    if not line.strip():
+        return None
+    if not line.startswith(b'ITEM: TIMESTEP'):
+        raise ValueError(f"Expected 'ITEM: TIMESTEP' in LAMMPS dump, found {line!r}")
+    file.readline()  # Timestep value
+    file.readline()  # ITEM: NUMBER OF ATOMS
+    n_atoms = int(file.readline())
+    file.readline()  # ITEM: BOX BOUNDS ...
+    bounds = np.array([file.readline().split() for _ in range(3)], dtype=np.float64)
+    columns = file.readline().decode().split()[2:]  # ITEM: ATOMS id type x y z ...
+    return n_atoms, bounds, columns
+
+def _lammps_cell(bounds):
+    """
+    Converts LAMMPS dump box bounds into the box origin and the cell vectors.
+
+    Returns:
+    - origin (np.ndarray): Lower corner of the box (xlo, ylo, zlo).
+    - cell (np.ndarray): Cell vectors as rows (3 x 3, upper triangle is zero).
+    """
+    xy, xz, yz = bounds[:, 2] if bounds.shape[1] == 3 else (0.0, 0.0, 0.0)
+    # Triclinic dumps store the bounding box of the cell; remove the tilt contribution
+    xlo = bounds[0, 0] - min(0.0, xy, xz, xy + xz)
+    xhi = bounds[0, 1] - max(0.0, xy, xz, xy + xz)
+    ylo = bounds[1, 0] - min(0.0, yz)
+    yhi = bounds[1, 1] - max(0.0, yz)
+    zlo, zhi = bounds[2, 0], bounds[2, 1]
+    cell = np.array([[xhi - xlo, 0.0, 0.0],
+                     [xy, yhi - ylo, 0.0],
+                     [xz, yz, zhi - zlo]])
+    return np.array([xlo, ylo, zlo]), cell
+
+def _cell_to_box(cell):
+    """
+    Converts cell vectors (rows of a 3 x 3 array) into lengths and angles
+    (a, b, c, alpha, beta, gamma), with the angles in degrees.
+    """
+    a, b, c = np.linalg.norm(cell, axis=1)
+    alpha = np.degrees(np.arccos(np.dot(cell[1], cell[2]) / (b * c)))
+    beta = np.degrees(np.arccos(np.dot(cell[0], cell[2]) / (a * c)))
+    gamma = np.degrees(np.arccos(np.dot(cell[0], cell[1]) / (a * b)))
+    return np.array([a, b, c, alpha, beta, gamma])
+
+def iter_lammps_dump_frames(file_path, start=0, stop=None, stride=1):
+    """
+    Lazily reads a LAMMPS text dump (e.g. written by 'dump custom ... id type x y z').
+
+    Wrapped (x y z), unwrapped (xu yu zu) and scaled (xs ys zs, xsu ysu zsu) coordinates
+    are recognised from the 'ITEM: ATOMS' line; scaled coordinates are converted with the
+    box of their own frame, including triclinic boxes. Atoms are sorted by their id, since
+    parallel runs write them in arbitrary order. Skipped frames are not parsed. The dump
+    is read sequentially, also when it is compressed.
+
+    Parameters:
+    - file_path (str): Path to the dump file.
+    - start, stop, stride (int): Frame selection, with the same meaning as a slice
+      (start and stop must not be negative).
+
+    Yields:
+    - coords (np.ndarray): Atomic positions of the current frame (N x 3). The array is
+      reused for the next frame, so copy it if it has to be kept.
+    - box (np.ndarray): Cell lengths and angles of the current frame (a, b, c, alpha,
+      beta, gamma).
+    """
+    _check_sequential_selection(start, stop)
+    coords = None
+
+    with open_trajectory_file(file_path) as file:
+        frame_index = 0
+        while stop is None or frame_index < stop:
+            header = _read_lammps_dump_header(file)
+            if header is None:
+                break
+            n_atoms, bounds, columns = header
+            if frame_index < start or (frame_index - start) % stride:
+                next(itertools.islice(file, n_atoms - 1, n_atoms), None)  # Skip the atom lines
+                frame_index += 1
+                continue
+
+            for names in LAMMPS_POSITION_COLUMNS:
+                if all(name in columns for name in names):
+                    break
+            else:
+                raise ValueError(f"No position columns in LAMMPS dump {file_path}: {columns}")
+            usecols = [columns.index(name) for name in names]
+            raw_atoms = b''.join(itertools.islice(file, n_atoms))
+            values = np.loadtxt(io.BytesIO(raw_atoms), usecols=usecols, ndmin=2)
+            if len(values) != n_atoms:
+                raise ValueError(f"Truncated frame {frame_index} in LAMMPS dump {file_path}")
+
+            if coords is None:
+                coords = np.empty((n_atoms, 3))
+            elif n_atoms != len(coords):
+                raise ValueError(f"Frame has {n_atoms} atoms instead of {len(coords)}")
+            origin, cell = _lammps_cell(bounds)
+            if names[0].startswith('xs'):
+                values = origin + values @ cell
+            if 'id' in columns:
+                ids = np.loadtxt(io.BytesIO(raw_atoms), usecols=columns.index('id'), dtype=np.int64, ndmin=1)
+                values = values[np.argsort(ids)]
+            coords[:] = values
+            yield coords, _cell_to_box(cell)
+            frame_index += 1
+
+def read_lammps_dump_box(file_path):
+    """
+    Reads the box of the first frame of a LAMMPS text dump.
+
+    Returns:
+    - box (np.ndarray): Cell lengths and angles (a, b, c, alpha, beta, gamma).
+    """
+    with open_trajectory_file(file_path) as file:
+        header = _read_lammps_dump_header(file)
+    if header is None:
+        return np.zeros(6)
+    return _cell_to_box(_lammps_cell(header[1])[1])
+
+def _read_dcd_header(file):
+    """
+    Reads the header of a DCD file and builds the record layout of its frames.
+
+    Returns:
+    - frame_dtype (np.dtype): Structured type of one frame, holding the unit cell (if
+      present) and the 'x', 'y', 'z' coordinate blocks.
+    - has_cell (bool): Whether the frames carry a unit cell record.
+    - header_size (int): Byte offset of the first frame.
+    """
+    header = file.read(92)
+    if header[4:8] != b'CORD':
+        raise ValueError("Not a DCD file")
+    endian = '<' if struct.unpack('<i', header[:4])[0] == 84 else '>'
+    icntrl = struct.unpack(endian + '20i', header[8:88])
+    n_fixed, has_cell, has_4d, charmm = icntrl[8], icntrl[10], icntrl[11], icntrl[19]
+    if n_fixed:
+        raise ValueError("DCD files with fixed atoms are not supported")
+
+    # Title record, then the atom count record
+    title_size = struct.unpack(endian + 'i', file.read(4))[0]
+    file.read(title_size + 4)
+    n_atoms = struct.unpack(endian + '3i', file.read(12))[1]
+    header_size = 92 + 4 + title_size + 4 + 12
+
+    def record(name, dtype, count):
+        return [(name + '_head', endian + 'i4'), (name, endian + dtype, count), (name + '_tail', endian + 'i4')]
+
+    has_cell = bool(charmm and has_cell)
+    fields = record('cell', 'f8', 6) if has_cell else []
+    fields += record('x', 'f4', n_atoms) + record('y', 'f4', n_atoms) + record('z', 'f4', n_atoms)
+    if charmm and has_4d:
+        fields += record('w', 'f4', n_atoms)
+    return np.dtype(fields), has_cell, header_size
+
+def _open_dcd(file_path, start=0, stop=None, stride=1):
+    """
+    Returns the selected frame records of a DCD file (see _read_dcd_header).
+
+    Uncompressed files are memory-mapped. Compressed files are decompressed on the fly
+    and their records read one after the other.
+
+    Returns:
+    - frames (np.memmap or generator): Selected frame records.
+    - has_cell (bool): Whether the frames carry a unit cell record.
+    """
+    if detect_compression(file_path) is not None:
+        _check_sequential_selection(start, stop)
+        file = open_trajectory_file(file_path)
+        frame_dtype, has_cell, _ = _read_dcd_header(file)
+
+        def iter_records():
+            with file:
+                while True:
+                    raw_record = file.read(frame_dtype.itemsize)
+                    if len(raw_record) < frame_dtype.itemsize:
+                        return
+                    yield np.frombuffer(raw_record, dtype=frame_dtype)[0]
+
+        return itertools.islice(iter_records(), start, stop, stride), has_cell
+
+    with open(file_path, 'rb') as file:
+        frame_dtype, has_cell, header_size = _read_dcd_header(file)
+    # The frame count comes from the file size, since the header count is not updated by all writers
+    n_frames = (os.path.getsize(file_path) - header_size) // frame_dtype.itemsize
+    frames = np.memmap(file_path, dtype=frame_dtype, mode='r', offset=header_size, shape=(n_frames,))
+    return frames[start:stop:stride], has_cell
+
+def _dcd_cell_to_box(cell):
+    """
+    Converts a DCD unit cell record (A, gamma, B, beta, alpha, C) into lengths and angles
+    (a, b, c, alpha, beta, gamma). Angles written as cosines (CHARMM, LAMMPS) are converted
+    to degrees.
+    """
+    angles = np.array([cell[4], cell[3], cell[1]])
+    if np.all(np.abs(angles) <= 1.0):
+        angles = np.degrees(np.arccos(angles))
+    return np.array([cell[0], cell[2], cell[5], *angles])
+
+def iter_dcd_frames(file_path, start=0, stop=None, stride=1):
+    """
+    Lazily reads a binary DCD trajectory (CHARMM/NAMD/LAMMPS 'dump dcd').
+
+    Frames are memory-mapped, so only the selected frames are ever read. Compressed files
+    are decompressed on the fly instead.
+
+    Parameters:
+    - file_path (str): Path to the DCD file.
+    - start, stop, stride (int): Frame selection, with the same meaning as a slice.
+
+    Yields:
+    - coords (np.ndarray): Atomic positions of the current frame (N x 3). The array is
+      reused for the next frame, so copy it if it has to be kept.
+    - box (np.ndarray): Cell lengths and angles of the current frame (a, b, c, alpha,
+      beta, gamma), or zeros if the file has no unit cell records.
+    """
+    frames, has_cell = _open_dcd(file_path, start, stop, stride)
+    coords = None
+    box = np.zeros(6)
+    for frame in frames:
+        if coords is None:
+            coords = np.empty((len(frame['x']), 3))
+        coords[:, 0] = frame['x']
+        coords[:, 1] = frame['y']
+        coords[:, 2] = frame['z']
+        if has_cell:
+            box = _dcd_cell_to_box(frame['cell'])
+        yield coords, box
+
+def read_dcd_box(file_path):
+    """
+    Reads the box of the first frame of a DCD file.
+
+    Returns:
+    - box (np.ndarray): Cell lengths and angles (a, b, c, alpha, beta, gamma), or zeros
+      if the file has no unit cell records.
+    """
+    frames, has_cell = _open_dcd(file_path, stop=1)
+    for frame in frames:
+        if has_cell:
+            return _dcd_cell_to_box(frame['cell'])
+    return np.zeros(6)
+
+def detect_format(file_path):
+    """
+    Identifies a trajectory file as 'pdb', 'lammps' (text dump) or 'dcd' from its first
+    (decompressed) bytes.
+    """
+    compression = detect_compression(file_path)
+    with (open(file_path, 'rb') if compression is None else compression.open(file_path, 'rb')) as file:
+        head = file.read(16)
+    if head[4:8] == b'CORD':
+        return 'dcd'
+    if head.startswith(b'ITEM: TIMESTEP'):
+        return 'lammps'
+    return 'pdb'
+
+def iter_frames(file_path, start=0, stop=None, stride=1):
+    """
+    Lazily reads a PDB, LAMMPS dump or DCD trajectory, detecting the format from the file.
+
+    Parameters:
+    - file_path (str): Path to the trajectory file.
+    - start, stop, stride (int): Frame selection, with the same meaning as a slice.
+
+    Yields:
+    - coords (np.ndarray): Atomic positions of the current frame (N x 3). The array is
+      reused for the next frame, so copy it if it has to be kept.
+    - box (np.ndarray): Cell lengths and angles of the current frame (a, b, c, alpha,
+      beta, gamma), or zeros if the file has no box information.
+    """
+    iter_format_frames = {'pdb': iter_pdb_frames, 'lammps': iter_lammps_dump_frames,
+                          'dcd': iter_dcd_frames}[detect_format(file_path)]
+    return iter_format_frames(file_path, start, stop, stride)
+
+def read_box(file_path):
+    """
+    Reads the box of the first frame of a PDB, LAMMPS dump or DCD trajectory.
+
+    Returns:
+    - box (np.ndarray): Cell lengths and angles (a, b, c, alpha, beta, gamma).
+    """
+    read_format_box = {'pdb': read_pdb_box, 'lammps': read_lammps_dump_box,
+                       'dcd': read_dcd_box}[detect_format(file_path)]
+    return read_format_box(file_path)
+
+def _convert_frame_chunk(pdb_file_path, cache_file_path, first_frame, frame_ranges):
+    """
+    Worker for convert_pdb_to_cache: decodes a contiguous run of frames and writes them,
+    with their boxes, into their slots of the shared cache file.
+
+    Parameters:
+    - pdb_file_path (str): Path to the PDB file.
+    - cache_file_path (str): Path of the (partially written) cache file.
+    - first_frame (int): Index of the first frame of the chunk in the trajectory.
+    - frame_ranges (np.ndarray): Start and end byte offset of each frame of the chunk.
+    """
+    frames, boxes = _map_cache(cache_file_path, mode='r+')
+    n_atoms = frames.shape[1]
+
+    # The whole chunk is read with a single call and split into frames in memory
+    chunk_start = frame_ranges[0, 0]
+    with open(pdb_file_path, 'rb') as file:
+        file.seek(chunk_start)
+        raw_chunk = file.read(frame_ranges[-1, 1] - chunk_start)
+
+    coords = np.empty((n_atoms, 3))
+    for frame_offset, (frame_start, frame_end) in enumerate(frame_ranges - chunk_start):
+        raw_frame = raw_chunk[frame_start:frame_end]
+        frames[first_frame + frame_offset] = decode_pdb_frame(raw_frame, coords)
+        frame_box = decode_pdb_box(raw_frame)
+        # Frames without a CRYST1 record are filled in from earlier frames once all chunks are done
+        boxes[first_frame + frame_offset] = np.nan if frame_box is None else frame_box
+    frames.flush()
+    boxes.flush()
+
+def convert_pdb_to_cache(pdb_file_path, cache_file_path=None, n_workers=None):
+    """
+    Converts a PDB trajectory into the binary coordinate cache.
+
+    The frame index splits the file into frame-aligned chunks that are decoded in a
+    process pool. Every worker writes its frames directly into the memory-mapped cache
+    file, so parsing time scales with the number of cores and no coordinates are sent
+    back between processes. The cache is written to a temporary file and moved into
+    place once complete, so an interrupted conversion never leaves a truncated cache.
+
+    Parameters:
+    - pdb_file_path (str): Path to the PDB file.
+    - cache_file_path (str): Path of the cache file (defaults to the PDB path + CACHE_SUFFIX).
+    - n_workers (int): Number of worker processes (None for all available cores).
+
+    Returns:
+    - cache_file_path (str): Path of the written cache file.
+    """
+    if cache_file_path is None:
+        cache_file_path = pdb_file_path + CACHE_SUFFIX
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    box = read_pdb_box(pdb_file_path)
+    index = load_frame_index(pdb_file_path)
+    n_frames = len(index)
+    if n_frames == 0:
+        raise ValueError(f"No frames found in {pdb_file_path}")
+
+    # The first frame fixes the number of atoms, and with it the size of the cache
+    with open(pdb_file_path, 'rb') as file:
+        file.seek(index[0, 0])
+        n_atoms = len(decode_pdb_frame(file.read(index[0, 1] - index[0, 0])))
+
+    # Several chunks per worker balance the load; each chunk stays small enough to read at once
+    n_bytes = index[-1, 1] - index[0, 0]
+    n_chunks = min(n_frames, max(4 * n_workers, n_bytes // PARSE_CHUNK_SIZE + 1))
+    chunks = np.array_split(np.arange(n_frames), n_chunks)
+
+    # The workers map the temporary file by its (unique) path
+    tmp_file_path = make_temp_file(cache_file_path)
+    try:
+        with open(tmp_file_path, 'wb') as cache_file:
+            cache_file.write(struct.pack(CACHE_HEADER_FORMAT, CACHE_MAGIC, n_frames, n_atoms, *box))
+            cache_file.truncate(_cache_size(n_frames, n_atoms))
+
+        if n_workers == 1:
+            for frame_ids in chunks:
+                _convert_frame_chunk(pdb_file_path, tmp_file_path, frame_ids[0], index[frame_ids])
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(_convert_frame_chunk, pdb_file_path, tmp_file_path,
+                                           frame_ids[0], index[frame_ids]) for frame_ids in chunks]
+                for future in futures:
+                    future.result()
+
+        # Frames without a CRYST1 record keep the box of the last frame that had one
+        _, boxes = _map_cache(tmp_file_path, mode='r+')
+        missing = np.isnan(boxes[:, 0])
+        if np.any(missing):
+            last_known = np.maximum.accumulate(np.where(missing, -1, np.arange(n_frames)))
+            boxes[:] = np.where(last_known[:, np.newaxis] >= 0, boxes[np.maximum(last_known, 0)], box)
+            boxes.flush()
+        del boxes
+
+        os.replace(tmp_file_path, cache_file_path)
+    except BaseException:
+        os.remove(tmp_file_path)
+        raise
+    return cache_file_path
+
+def convert_to_cache(file_path, cache_file_path=None, n_workers=None):
+    """
+    Converts a PDB, LAMMPS dump or DCD trajectory into the binary coordinate cache.
+
+    Uncompressed PDB files are decoded in parallel by convert_pdb_to_cache. All other
+    files are streamed into the cache one frame at a time, so the conversion runs in
+    constant memory.
+
+    Parameters:
+    - file_path (str): Path to the trajectory file.
+    - cache_file_path (str): Path of the cache file (defaults to the trajectory path + CACHE_SUFFIX).
+    - n_workers (int): Number of worker processes for PDB files (None for all available cores).
+
+    Returns:
+    - cache_file_path (str): Path of the written cache file.
+    """
+    if detect_format(file_path) == 'pdb' and detect_compression(file_path) is None:
+        return convert_pdb_to_cache(file_path, cache_file_path, n_workers)
+
+    if cache_file_path is None:
+        cache_file_path = file_path + CACHE_SUFFIX
+
+    n_atoms = 0
+    boxes = []
+    tmp_file_path = make_temp_file(cache_file_path)
+    try:
+        with open(tmp_file_path, 'wb') as cache_file:
+            cache_file.write(bytes(CACHE_HEADER_SIZE))
+            for coords, box in iter_frames(file_path):
+                coords.astype(np.float32).tofile(cache_file)
+                n_atoms = len(coords)
+                boxes.append(box.copy())
+
+            # The boxes follow the coordinates, and the frame count is only known at the end,
+            # so the header is written last
+            n_frames = len(boxes)
+            if n_frames:
+                np.array(boxes, dtype=np.float64).tofile(cache_file)
+                cache_file.seek(0)
+                cache_file.write(struct.pack(CACHE_HEADER_FORMAT, CACHE_MAGIC, n_frames, n_atoms, *boxes[0]))
+
+        if n_frames == 0:
+            raise ValueError(f"No frames found in {file_path}")
+        os.replace(tmp_file_path, cache_file_path)
+    except BaseException:
+        os.remove(tmp_file_path)
+        raise
+    return cache_file_path
+
+def _cache_size(n_frames, n_atoms):
+    """
+    Returns the size in bytes of a cache file holding `n_frames` frames of `n_atoms` atoms.
+    """
+    return CACHE_HEADER_SIZE + n_frames * (n_atoms * 3 * 4 + 6 * 8)
+
+def _map_cache(cache_file_path, mode='r'):
+    """
+    Memory-maps the coordinate and box arrays of a cache file.
+
+    Returns:
+    - frames (np.memmap): Atomic positions for every frame (n_frames x N x 3, float32).
+    - boxes (np.memmap): Box of every frame (n_frames x 6, float64).
+    """
+    with open(cache_file_path, 'rb') as cache_file:
+        header = cache_file.read(struct.calcsize(CACHE_HEADER_FORMAT))
+    magic, n_frames, n_atoms, *_ = struct.unpack(CACHE_HEADER_FORMAT, header)
+    if magic != CACHE_MAGIC or os.path.getsize(cache_file_path) != _cache_size(n_frames, n_atoms):
+        raise ValueError(f"{cache_file_path} is not a trajectory cache file of the current format")
+
+    frames = np.memmap(cache_file_path, dtype=np.float32, mode=mode, offset=CACHE_HEADER_SIZE,
+                       shape=(n_frames, n_atoms, 3))
+    boxes = np.memmap(cache_file_path, dtype=np.float64, mode=mode,
+                      offset=CACHE_HEADER_SIZE + n_frames * n_atoms * 3 * 4, shape=(n_frames, 6))
+    return frames, boxes
+
+def open_cache(cache_file_path):
+    """
+    Opens a binary coordinate cache as read-only memory maps.
+
+    Parameters:
+    - cache_file_path (str): Path of the cache file.
+
+    Returns:
+    - frames (np.memmap): Atomic positions for every frame (n_frames x N x 3, float32).
+    - boxes (np.memmap): Cell lengths and angles (a, b, c, alpha, beta, gamma) of every
+      frame (n_frames x 6, float64).
+    """
+    return _map_cache(cache_file_path, mode='r')
+
+def _is_cache_current(cache_file_path, file_path):
+    """
+    Checks that a cache file exists, is newer than its trajectory and has the current format.
+    """
+    if (not os.path.exists(cache_file_path)
+            or os.path.getmtime(cache_file_path) < os.path.getmtime(file_path)):
+        return False
+    try:
+        _map_cache(cache_file_path)
+    except ValueError:
+        return False
+    return True
+
+def _apply_default_box(frames, default_box):
+    """
+    Replaces the boxes of frames without box information, i.e. without any cell length
+    (also when a CRYST1 record of 0 0 0 90 90 90, as written by VMD, gave them angles).
+    """
+    for coords, box in frames:
+        yield coords, box if np.any(box[:3] > 0) else default_box
+
+def load_trajectory(file_path, start=0, stop=None, stride=1, use_cache=None, n_workers=None, default_box=None):
+    """
+    Returns the selected frames of a PDB, LAMMPS dump or DCD trajectory.
+
+    By default the frames come from the binary cache, which is created on first use and
+    rebuilt whenever the trajectory file is newer than it, so later runs skip the parsing
+    entirely and only page in the frames they touch. Without the cache the selected
+    frames are streamed directly from the trajectory file. Compressed trajectories are
+    streamed by default, so nothing uncompressed is written to disk. If the cache cannot
+    be written (e.g. next to a trajectory in a read-only directory), the frames are
+    streamed as well.
+
+    Parameters:
+    - file_path (str): Path to the trajectory file.
+    - start, stop, stride (int): Frame selection, with the same meaning as a slice.
+    - use_cache (bool): Whether to read the frames through the binary cache (None to
+      cache uncompressed trajectories only).
+    - n_workers (int): Number of processes used to build the cache (None for all cores).
+    - default_box (float or np.ndarray): Box used for frames without box information, as
+      (a, b, c, alpha, beta, gamma) or the length of a cubic box. None leaves them empty.
+
+    Returns:
+    - frames (iterable): Pairs of atomic positions (N x 3) and box (a, b, c, alpha, beta,
+      gamma) for every selected frame. From the cache, the positions are float32 rows of
+      the memory map; without it, they come from iter_frames and share one buffer.
+    """
+    if use_cache is None:
+        use_cache = detect_compression(file_path) is None
+    if use_cache:
+        cache_file_path = file_path + CACHE_SUFFIX
+        if not _is_cache_current(cache_file_path, file_path):
+            print(f"Converting {file_path} to {cache_file_path}")
+            try:
+                convert_to_cache(file_path, cache_file_path, n_workers)
+            except OSError as error:
+                print(f"Could not write {cache_file_path} ({error}), streaming the trajectory instead")
+                use_cache = False
+    if use_cache:
+        frames, boxes = open_cache(cache_file_path)
+        selected = slice(start, stop, stride)
+        trajectory = zip(frames[selected], boxes[selected])
+    else:
+        trajectory = iter_frames(file_path, start, stop, stride)
+
+    if default_box is None:
+        return trajectory
+    if np.ndim(default_box) == 0:
+        default_box = [default_box] * 3 + [90.0] * 3
+    return _apply_default_box(trajectory, np.asarray(default_box, dtype=np.float64))
+
+# Convert the trajectories (PDB, LAMMPS dump or DCD) given on the command line
+if __name__ == "__main__":
+    for file_path in sys.argv[1:]:
+        cache_file_path = convert_to_cache(file_path)
+        frames, _ = open_cache(cache_file_path)
+        print(f"{file_path}: {frames.shape[0]} frames, {frames.shape[1]} atoms -> {cache_file_path}")